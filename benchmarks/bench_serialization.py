@@ -0,0 +1,82 @@
+# Benchmark del coste de serialización por petición (sin red ni base de datos).
+# Compara el camino original (ORM -> response_model con validadores de entrada -> jsonable_encoder -> json)
+# con el modo FAST_RESPONSES (fila -> dict -> orjson).
+# Uso: python benchmarks/bench_serialization.py
+
+import os, sys, json, timeit
+from datetime import date, timedelta
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pydantic import TypeAdapter
+from fastapi.encoders import jsonable_encoder
+from models import DailyLogDB, METRIC_COLUMNS
+from schemas import DailyLogInput, DailyLogOutput, MetricsSummary, RollingSeriesOut
+from responses import FastJSONResponse
+
+ITERATIONS = 20000
+
+
+# Modelo de salida original: heredaba de DailyLogInput y repetía sus validadores
+class LegacyDailyLogOutput(DailyLogInput):
+    user_id: str
+    model_config = {"from_attributes": True}
+
+
+LOG_FIELDS = ["log_date", *(col.name for col in METRIC_COLUMNS), "user_id"]
+log_orm = DailyLogDB(user_id="fb98d44ad7", log_date=date.today() - timedelta(days=1), steps=10500,
+                     exercise_minutes=60, sleep_hours=7.8, water_liters=2.5, diet_score=8, mood=9)
+log_row = tuple(getattr(log_orm, field) for field in LOG_FIELDS)
+trends = {col.name: 1234.5678 for col in METRIC_COLUMNS}
+rolling = {
+    "start": date.today() - timedelta(days=89),
+    "end": date.today(),
+    "dates": [date.today() - timedelta(days=d) for d in range(90)],
+    "series": {f"avg_{col.name}_{w}d": [float(i) for i in range(90)] for col in METRIC_COLUMNS for w in (7, 28)},
+}
+
+summary_adapter = TypeAdapter(MetricsSummary)
+
+
+def before_log():
+    model = LegacyDailyLogOutput.model_validate(log_orm)
+    return json.dumps(jsonable_encoder(model)).encode()
+
+def after_log():
+    return FastJSONResponse(content=dict(zip(LOG_FIELDS, log_row))).body
+
+def output_model_log():
+    model = DailyLogOutput.model_validate(log_orm)
+    return json.dumps(jsonable_encoder(model)).encode()
+
+def before_trends():
+    return json.dumps(jsonable_encoder(summary_adapter.validate_python(trends))).encode()
+
+def after_trends():
+    return FastJSONResponse(content=trends).body
+
+def before_rolling():
+    return json.dumps(jsonable_encoder(RollingSeriesOut.model_validate(rolling))).encode()
+
+def after_rolling():
+    return FastJSONResponse(content=rolling).body
+
+
+def measure(func, iterations: int = ITERATIONS) -> float:
+    """Devuelve el coste medio por llamada en microsegundos (mejor de 3 repeticiones)."""
+    return min(timeit.repeat(func, number=iterations, repeat=3)) / iterations * 1e6
+
+
+if __name__ == "__main__":
+    cases = [
+        ("POST/PUT /user/logs", before_log, after_log),
+        ("  (solo DailyLogOutput sin validadores)", before_log, output_model_log),
+        ("GET /user/trends", before_trends, after_trends),
+        ("GET /user/trends/rolling (90 días, 12 series)", before_rolling, after_rolling),
+    ]
+    print(f"{'Endpoint':48} {'antes (µs)':>11} {'después (µs)':>13} {'mejora':>8}")
+    for name, before, after in cases:
+        iterations = ITERATIONS if "rolling" not in name else ITERATIONS // 20
+        t_before, t_after = measure(before, iterations), measure(after, iterations)
+        print(f"{name:48} {t_before:11.2f} {t_after:13.2f} {t_before / t_after:7.1f}x")
@@ -0,0 +1,137 @@
+import os, logging
+from datetime import date, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy import func
+
+from models import DailyLogDB, MonthlyLogSummaryDB, METRIC_COLUMNS
+
+logger = logging.getLogger("main.compaction")
+
+# ------ Configuración de retención ------
+# Los logs diarios con más de LOG_RETENTION_DAYS días se resumen por meses en `logs_monthly`
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 730))
+COMPACTION_CHUNK_SIZE = int(os.getenv("COMPACTION_CHUNK_SIZE", 5000))
+
+METRIC_NAMES = [col.name for col in METRIC_COLUMNS]
+
+
+def compaction_cutoff(today: Optional[date] = None) -> date:
+    """Primer día que se conserva en detalle. Se compactan siempre meses completos."""
+    limit = (today or date.today()) - timedelta(days=LOG_RETENTION_DAYS)
+    return limit.replace(day=1)
+
+
+def is_compacted(db, user_id: str, log_date: date) -> bool:
+    """Indica si el mes de `log_date` ya está resumido en `logs_monthly` para el usuario."""
+    return db.get(MonthlyLogSummaryDB, (user_id, log_date.replace(day=1))) is not None
+
+
+def compacted_month_detail(log_date: date) -> str:
+    """Mensaje de error de las escrituras en un mes compactado."""
+    return f"No se puede registrar ni modificar el log del {log_date}: el mes {log_date:%Y-%m} ya está compactado."
+
+
+def _merge_value(summary: MonthlyLogSummaryDB, metric: str, value):
+    """Acumula un valor diario en el resumen mensual de la métrica."""
+    if value is None:
+        return
+    count = getattr(summary, f"{metric}_count") or 0
+    setattr(summary, f"{metric}_count", count + 1)
+    setattr(summary, f"{metric}_sum", (getattr(summary, f"{metric}_sum") or 0) + value)
+    setattr(summary, f"{metric}_sumsq", (getattr(summary, f"{metric}_sumsq") or 0) + value * value)
+    current_min, current_max = getattr(summary, f"{metric}_min"), getattr(summary, f"{metric}_max")
+    setattr(summary, f"{metric}_min", value if current_min is None else min(current_min, value))
+    setattr(summary, f"{metric}_max", value if current_max is None else max(current_max, value))
+
+
+def compact_logs(
+    session_factory: Callable,
+    cutoff: Optional[date] = None,
+    chunk_size: int = COMPACTION_CHUNK_SIZE,
+    before_commit: Optional[Callable] = None,
+) -> int:
+    """Mueve los logs anteriores a `cutoff` a los resúmenes mensuales y borra las filas diarias.
+
+    Se procesa por bloques de `chunk_size` filas: cada bloque acumula sus filas en los resúmenes
+    y las borra en la misma transacción, de modo que el proceso puede interrumpirse y reanudarse
+    sin contar dos veces ningún día. Devuelve el número de filas compactadas.
+    """
+    cutoff = cutoff or compaction_cutoff()
+    total = 0
+    while True:
+        db = session_factory()
+        try:
+            rows = db.query(DailyLogDB.user_id, DailyLogDB.log_date, *METRIC_COLUMNS).filter(
+                DailyLogDB.log_date < cutoff
+            ).order_by(DailyLogDB.user_id, DailyLogDB.log_date).limit(chunk_size).all()
+            if not rows:
+                return total
+
+            summaries: Dict[tuple, MonthlyLogSummaryDB] = {}
+            last_date: Dict[str, date] = {}
+            for row in rows:
+                key = (row.user_id, row.log_date.replace(day=1))
+                summary = summaries.get(key)
+                if summary is None:
+                    summary = db.get(MonthlyLogSummaryDB, key)
+                    if summary is None:
+                        summary = MonthlyLogSummaryDB(user_id=key[0], month=key[1], days=0)
+                        for metric in METRIC_NAMES:
+                            setattr(summary, f"{metric}_count", 0)
+                        db.add(summary)
+                    summaries[key] = summary
+                summary.days += 1
+                for metric in METRIC_NAMES:
+                    _merge_value(summary, metric, getattr(row, metric))
+                last_date[row.user_id] = row.log_date
+
+            # Las filas del bloque son, para cada usuario, todos sus logs hasta la última fecha leída
+            for user_id, until in last_date.items():
+                db.query(DailyLogDB).filter(
+                    DailyLogDB.user_id == user_id,
+                    DailyLogDB.log_date <= until
+                ).delete(synchronize_session=False)
+            if before_commit is not None:
+                before_commit(db, set(last_date))
+            db.commit()
+            total += len(rows)
+            logger.info(f"Compactación: {len(rows)} logs anteriores a {cutoff} resumidos en {len(summaries)} meses.")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error durante la compactación de logs: {e}")
+            raise
+        finally:
+            db.close()
+
+
+def archived_stats(db, user_id: str, start: date, end: Optional[date]) -> Dict[str, dict]:
+    """Estadísticas (count, sum, min, max) por métrica de los meses compactados que solapan con el rango.
+    La resolución de este nivel es mensual: un mes se incluye completo si solapa con el período."""
+    columns = []
+    for metric in METRIC_NAMES:
+        columns += [
+            func.sum(getattr(MonthlyLogSummaryDB, f"{metric}_count")).label(f"{metric}_count"),
+            func.sum(getattr(MonthlyLogSummaryDB, f"{metric}_sum")).label(f"{metric}_sum"),
+            func.min(getattr(MonthlyLogSummaryDB, f"{metric}_min")).label(f"{metric}_min"),
+            func.max(getattr(MonthlyLogSummaryDB, f"{metric}_max")).label(f"{metric}_max"),
+        ]
+    filters = [MonthlyLogSummaryDB.user_id == user_id, MonthlyLogSummaryDB.month >= start.replace(day=1)]
+    if end is not None:
+        filters.append(MonthlyLogSummaryDB.month <= end)
+    row = db.query(*columns).filter(*filters).one()._asdict()
+    return {
+        metric: {stat: row[f"{metric}_{stat}"] for stat in ("count", "sum", "min", "max")}
+        for metric in METRIC_NAMES
+    }
+
+
+def compact_all_shards(before_commit: Optional[Callable] = None) -> int:
+    """Ejecuta la compactación en cada shard."""
+    from database import shard_sessions
+    return sum(compact_logs(session_factory, before_commit=before_commit) for session_factory in shard_sessions)
+
+
+if __name__ == "__main__":
+    from main import bump_data_versions
+    compacted = compact_all_shards(before_commit=bump_data_versions)
+    print(f"Logs compactados: {compacted} (anteriores a {compaction_cutoff()}).")
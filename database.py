@@ -1,9 +1,98 @@
-from sqlalchemy import create_engine
+import os, hashlib
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker 
 from sqlalchemy.ext.declarative import declarative_base
 
 # ------ DB setup ------
 DATABASE_URL = "sqlite:///./healthy_logs.db"  
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+Base = declarative_base()
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite no aplica las claves foráneas (ni ON DELETE CASCADE) salvo que se active en cada conexión."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def _create_engine(url: str):
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    new_engine = create_engine(url, connect_args=connect_args)
+    if url.startswith("sqlite"):
+        event.listen(new_engine, "connect", _enable_sqlite_foreign_keys)
+    return new_engine
+
+engine = _create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+
+# ------ Sharding opcional ------
+# Con SHARD_URLS (URLs separadas por comas) las tablas de usuarios y logs se reparten entre varias
+# bases de datos según el hash del user_id. Sin SHARD_URLS hay un único shard: la base de datos principal.
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+shard_engines = [_create_engine(url) for url in SHARD_URLS] or [engine]
+shard_sessions = [sessionmaker(autocommit=False, autoflush=False, bind=shard_engine) for shard_engine in shard_engines]
+
+def shard_index(user_id: str) -> int:
+    """Shard de un usuario. Los ids generados a partir del email son hexadecimales."""
+    try:
+        value = int(user_id, 16)
+    except ValueError:
+        value = int(hashlib.sha256(user_id.encode()).hexdigest()[:10], 16)
+    return value % len(shard_engines)
+
+def get_session(user_id: str):
+    """Abre una sesión en el shard que almacena los datos del usuario."""
+    return shard_sessions[shard_index(user_id)]()
+
+def shard_batches(user_ids=None, chunk_size: int = 500):
+    """Pares (fábrica de sesiones, bloque de ids) para consultar un conjunto de usuarios con listas IN de
+    como máximo `chunk_size` ids, cada bloque en el shard de sus usuarios. Sin ids: (fábrica, None) por shard."""
+    if user_ids is None:
+        return [(session_factory, None) for session_factory in dict.fromkeys(shard_sessions)]
+    by_shard = {}
+    for user_id in dict.fromkeys(user_ids):
+        by_shard.setdefault(shard_index(user_id), []).append(user_id)
+    return [
+        (shard_sessions[index], ids[offset:offset + chunk_size])
+        for index, ids in by_shard.items()
+        for offset in range(0, len(ids), chunk_size)
+    ]
+
+def all_engines():
+    """Base de datos principal y todos los shards (sin duplicados)."""
+    return [engine] + [shard_engine for shard_engine in shard_engines if shard_engine is not engine]
+
+def add_missing_columns(bind=engine):
+    """Añade a las tablas ya existentes las columnas nuevas de los modelos (create_all no modifica tablas creadas)."""
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+
+def init_db():
+    """Crea las tablas (y añade las columnas nuevas) en la base de datos principal y en cada shard."""
+    import models  # noqa: F401  Registra los modelos en Base.metadata
+    for db_engine in all_engines():
+        Base.metadata.create_all(bind=db_engine)
+        add_missing_columns(db_engine)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Gestión de la base de datos.")
+    parser.add_argument("--init-db", action="store_true", help="Crea o actualiza el esquema de la base de datos.")
+    args = parser.parse_args()
+    if args.init_db:
+        # Ejecutado como script este módulo es __main__: los modelos heredan del Base del módulo
+        # `database` importado, así que el esquema se crea con ese
+        import database
+        database.init_db()
+        print(f"Esquema creado en {len(database.all_engines())} base(s) de datos.")
+    else:
+        parser.print_help()
@@ -0,0 +1,289 @@
+import os, json, asyncio, hashlib, logging
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+
+from models import IdempotencyKeyDB
+from scheduler import utcnow
+from security import decode_access_token
+
+logger = logging.getLogger("main.idempotency")
+
+# Horas que se conserva una respuesta y segundos de reserva de una petición en curso
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", 60))
+# Espera máxima de un duplicado simultáneo y tamaño máximo de una respuesta guardada
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", 64 * 1024))
+# Número máximo de claves por base de datos (la purga borra las más antiguas)
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 100000))
+MAX_KEY_LENGTH = 255
+
+# Respuestas que no se guardan: la petición no llegó a ejecutarse y el reintento debe repetirla
+NOT_STORED_STATUS = {401, 403, 408, 409, 429}
+# Cabeceras de la respuesta original que se reproducen
+REPLAYED_HEADERS = {b"content-type", b"location", b"etag", b"last-modified", b"cache-control"}
+
+
+def error_response(status_code: int, detail: str, headers: Optional[dict] = None) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+
+
+async def read_body(receive) -> bytes:
+    """Lee el cuerpo completo de una petición ASGI."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def replay_receive(body: bytes, receive):
+    """`receive` que entrega primero el cuerpo ya leído y después los mensajes reales (p.ej. la desconexión del cliente)."""
+    pending = [body]
+
+    async def replay():
+        if not pending:
+            return await receive()
+        return {"type": "http.request", "body": pending.pop(), "more_body": False}
+    return replay
+
+
+class IdempotencyStore:
+    """Reservas y respuestas guardadas en la tabla `idempotency_keys` del shard de cada scope.
+    Todos los métodos son síncronos; el middleware los ejecuta en un hilo."""
+
+    def __init__(self, session_factory: Callable[[str], object]):
+        self._session_factory = session_factory      # session_factory(scope)
+
+    def claim(self, scope: str, key: str, request_hash: str) -> Optional[IdempotencyKeyDB]:
+        """Reserva la clave para esta petición. Devuelve None si se ha reservado o la fila existente
+        (en curso o terminada) si otra petición la tiene."""
+        db = self._session_factory(scope)
+        now = utcnow()
+        try:
+            row = db.get(IdempotencyKeyDB, (scope, key))
+            if row is not None and row.expires_at >= now:
+                db.expunge(row)
+                return row
+            if row is not None:
+                # Respuesta caducada o reserva abandonada (el worker que la tenía se detuvo)
+                db.delete(row)
+                db.flush()
+            db.add(IdempotencyKeyDB(
+                scope=scope, key=key, request_hash=request_hash,
+                created_at=now, expires_at=now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+            ))
+            db.commit()
+            return None
+        except IntegrityError:
+            # Otra petición ha reservado la clave a la vez
+            db.rollback()
+            row = db.get(IdempotencyKeyDB, (scope, key))
+            if row is not None:
+                db.expunge(row)
+            return row
+        finally:
+            db.close()
+
+    def get(self, scope: str, key: str) -> Optional[IdempotencyKeyDB]:
+        db = self._session_factory(scope)
+        try:
+            row = db.get(IdempotencyKeyDB, (scope, key))
+            if row is not None:
+                db.expunge(row)
+            return row
+        finally:
+            db.close()
+
+    def complete(self, scope: str, key: str, status_code: int, headers: list, body: bytes):
+        db = self._session_factory(scope)
+        try:
+            db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.scope == scope, IdempotencyKeyDB.key == key).update({
+                IdempotencyKeyDB.status_code: status_code,
+                IdempotencyKeyDB.headers: json.dumps(headers),
+                IdempotencyKeyDB.body: body,
+                IdempotencyKeyDB.expires_at: utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al guardar la respuesta idempotente {scope}/{key}: {e}")
+        finally:
+            db.close()
+
+    def release(self, scope: str, key: str):
+        """Libera la reserva sin guardar respuesta, para que un reintento vuelva a ejecutar la petición."""
+        db = self._session_factory(scope)
+        try:
+            db.query(IdempotencyKeyDB).filter(
+                IdempotencyKeyDB.scope == scope, IdempotencyKeyDB.key == key, IdempotencyKeyDB.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al liberar la clave idempotente {scope}/{key}: {e}")
+        finally:
+            db.close()
+
+
+def purge_idempotency_keys(session_factories: Iterable[Callable], max_keys: int = IDEMPOTENCY_MAX_KEYS) -> int:
+    """Borra las claves caducadas y, si una base de datos supera `max_keys`, las más antiguas."""
+    purged = 0
+    for session_factory in session_factories:
+        db = session_factory()
+        try:
+            purged += db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.expires_at < utcnow()).delete(synchronize_session=False)
+            oldest_kept = db.query(IdempotencyKeyDB.created_at).order_by(IdempotencyKeyDB.created_at.desc()).offset(max_keys - 1).limit(1).scalar()
+            if oldest_kept is not None:
+                purged += db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.created_at < oldest_kept).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return purged
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI para la cabecera Idempotency-Key en las rutas indicadas.
+
+    La primera petición con una clave la reserva, se ejecuta y su respuesta se guarda. Un reintento
+    con la misma clave y el mismo cuerpo recibe la respuesta guardada sin ejecutar el endpoint (ni
+    validar el cuerpo ni tocar la tabla `logs`); si la original sigue en curso, espera a que termine.
+    Reutilizar la clave con otro cuerpo devuelve 422.
+
+    Las claves se guardan por sujeto: el usuario del token en `authenticated_paths` o el que devuelva
+    `body_scopes[ruta](cuerpo)` en las rutas sin token. Una petición sin sujeto se ejecuta sin idempotencia."""
+
+    def __init__(self, app, store: IdempotencyStore, routes: Set[Tuple[str, str]], authenticated_paths: Set[str],
+                 body_scopes: Optional[Dict[str, Callable[[bytes], Optional[str]]]] = None):
+        self.app = app
+        self.store = store
+        self.routes = routes                            # {(método, ruta)}
+        self.authenticated_paths = authenticated_paths  # Rutas cuyo scope es el usuario del token
+        self.body_scopes = body_scopes or {}            # Rutas cuyo scope se deriva del cuerpo
+        self._in_flight: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            return await self.app(scope, receive, send)
+        key = self._header(scope, b"idempotency-key")
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await error_response(400, f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres.")(scope, receive, send)
+
+        owner = None
+        if scope["path"] in self.authenticated_paths:
+            owner = self._user_id(scope)
+            if owner is None:
+                # Sin token válido el endpoint responderá 401; no hay nada que guardar
+                return await self.app(scope, receive, send)
+
+        body = await read_body(receive)
+        if owner is None:
+            scope_of = self.body_scopes.get(scope["path"])
+            owner = scope_of(body) if scope_of is not None else None
+            if owner is None:
+                # Sin sujeto no se comparte la clave entre clientes: la petición se ejecuta sin más
+                return await self.app(scope, replay_receive(body, receive), send)
+        request_hash = hashlib.sha256(
+            b"|".join([scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body])
+        ).hexdigest()
+
+        existing = await asyncio.to_thread(self.store.claim, owner, key, request_hash)
+        if existing is not None:
+            return await self._replay_or_wait(existing, owner, key, request_hash, scope, receive, send)
+
+        in_flight = asyncio.Event()
+        self._in_flight[(owner, key)] = (asyncio.get_running_loop(), in_flight)
+        try:
+            await self._execute(owner, key, body, scope, receive, send)
+        finally:
+            in_flight.set()
+            self._in_flight.pop((owner, key), None)
+
+    async def _execute(self, owner: str, key: str, body: bytes, scope, receive, send):
+        response_start, chunks = {}, []
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response_start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive(body, receive), capture_send)
+        except BaseException:
+            await asyncio.to_thread(self.store.release, owner, key)
+            raise
+        status_code = response_start.get("status", 500)
+        response_body = b"".join(chunks)
+        if status_code >= 500 or status_code in NOT_STORED_STATUS or len(response_body) > IDEMPOTENCY_MAX_BODY_BYTES:
+            await asyncio.to_thread(self.store.release, owner, key)
+            return
+        headers = [
+            [name.decode("latin-1"), value.decode("latin-1")]
+            for name, value in response_start.get("headers", []) if name.lower() in REPLAYED_HEADERS
+        ]
+        await asyncio.to_thread(self.store.complete, owner, key, status_code, headers, response_body)
+
+    async def _replay_or_wait(self, row: IdempotencyKeyDB, owner: str, key: str, request_hash: str, scope, receive, send):
+        if row.request_hash != request_hash:
+            return await error_response(422, "La Idempotency-Key ya se usó con otra petición.")(scope, receive, send)
+        if row.status_code is None:
+            row = await self._wait(owner, key)
+            if row is None:
+                # La petición original falló y liberó la clave: el cliente puede reintentar
+                return await error_response(409, "La petición original no se completó. Reinténtala.", {"Retry-After": "1"})(scope, receive, send)
+            if row.status_code is None:
+                return await error_response(409, "La petición original sigue en curso.", {"Retry-After": "1"})(scope, receive, send)
+        logger.info(f"Respuesta idempotente reproducida para {owner}/{key} ({row.status_code}).")
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.headers or "[]")]
+        headers += [(b"content-length", str(len(row.body or b"")).encode()), (b"idempotent-replayed", b"true")]
+        await send({"type": "http.response.start", "status": row.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": row.body or b""})
+
+    async def _wait(self, owner: str, key: str) -> Optional[IdempotencyKeyDB]:
+        """Espera a que termine la petición original: con un evento si está en este proceso o
+        consultando la tabla si la atiende otro worker."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            in_flight_loop, in_flight = self._in_flight.get((owner, key), (None, None))
+            remaining = deadline - loop.time()
+            if in_flight_loop is loop:
+                try:
+                    await asyncio.wait_for(in_flight.wait(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(0.05, max(remaining, 0)))
+            row = await asyncio.to_thread(self.store.get, owner, key)
+            if row is None or row.status_code is not None or loop.time() >= deadline:
+                return row
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for header, value in scope["headers"]:
+            if header == name:
+                return value.decode("latin-1").strip()
+        return None
+
+    def _user_id(self, scope) -> Optional[str]:
+        scheme, _, token = (self._header(scope, b"authorization") or "").partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+        try:
+            return decode_access_token(token).get("sub")
+        except Exception:
+            return None
+
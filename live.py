@@ -0,0 +1,101 @@
+import json, asyncio, threading, logging
+from collections import deque
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger("main.live")
+
+
+class Subscription:
+    """Conexión de un cliente al canal en vivo. Los eventos se guardan en una cola acotada: si el
+    cliente no los consume a tiempo se descartan los más antiguos (`dropped`) en lugar de bloquear
+    a quien publica."""
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop, max_queue: int):
+        self.user_id = user_id
+        self.dropped = 0
+        self.closed = False
+        self._events: deque = deque(maxlen=max_queue)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def push(self, event: dict):
+        """Encola un evento. Se puede llamar desde cualquier hilo."""
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:    # El bucle de eventos ya se ha cerrado
+            pass
+
+    async def next_batch(self, timeout: float) -> list:
+        """Espera hasta `timeout` segundos y devuelve todos los eventos pendientes (lista vacía si no hay)."""
+        if not self._events and not self.closed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        batch = []
+        while self._events:
+            batch.append(self._events.popleft())
+        return batch
+
+
+class LiveHub:
+    """Pub/sub en memoria (por proceso) de los cambios de datos de cada usuario."""
+
+    def __init__(self, max_queue: int = 100, max_subscriptions_per_user: int = 5):
+        self.max_queue = max_queue
+        self.max_subscriptions_per_user = max_subscriptions_per_user
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: str) -> Optional[Subscription]:
+        """Registra una conexión del usuario (None si ya tiene demasiadas abiertas)."""
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            current = self._subscriptions.setdefault(user_id, set())
+            if len(current) >= self.max_subscriptions_per_user:
+                return None
+            current.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            current = self._subscriptions.get(subscription.user_id)
+            if current is not None:
+                current.discard(subscription)
+                if not current:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id: str, event: dict) -> int:
+        """Envía el evento a las conexiones del usuario. Devuelve a cuántas se ha entregado."""
+        with self._lock:
+            targets = list(self._subscriptions.get(user_id, ()))
+        for subscription in targets:
+            subscription.push(event)
+        return len(targets)
+
+    def close_user(self, user_id: str):
+        """Cierra todas las conexiones del usuario (p.ej. al eliminar su cuenta)."""
+        with self._lock:
+            targets = self._subscriptions.pop(user_id, set())
+        for subscription in targets:
+            subscription.close()
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(current) for current in self._subscriptions.values())
+
+
+def sse_event(event: str, data) -> str:
+    """Formatea un evento Server-Sent Events (las fechas se serializan en ISO 8601)."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
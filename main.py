@@ -1,45 +1,76 @@
-import os
-from fastapi import FastAPI, HTTPException, Query, Depends
+import os, json, time, heapq, hashlib, asyncio
+from startup import startup_report, FirstRequestTimer     # Primero: mide el tiempo de arranque
+from contextlib import asynccontextmanager
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from typing import Optional, List
-from datetime import datetime, date, timedelta  
-from sqlalchemy import func 
+from typing import Optional, List, Union
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import func, case, and_, or_, cast, select, union_all, Float
 import logging
-from logging.handlers import RotatingFileHandler
 
 # ------ Módulos Locales ------
-from database import Base, engine, SessionLocal
-from models import  UserDB, DailyLogDB
-from security import create_access_token, decode_access_token ,hash_password, verify_password, generate_user_id
-from schemas import User, UserSignUp, UserLogin, UserUpdate, UserOut, DailyLogInput, DailyLogOutput, MetricType, LogTrendsOut, MetricsSummary
-
+from database import SessionLocal, get_session, all_engines, init_db, shard_sessions, shard_batches
+from models import  UserDB, DailyLogDB, MonthlyLogSummaryDB, RefreshTokenDB, IdempotencyKeyDB, METRIC_COLUMNS
+from compaction import compaction_cutoff, archived_stats, compact_all_shards, is_compacted, compacted_month_detail
+from scheduler import Scheduler, utcnow
+from security import create_access_token, decode_access_token ,hash_password, verify_password, generate_user_id, password_needs_rehash, hash_cost, BCRYPT_ROUNDS
+from security import create_refresh_token, hash_refresh_token, refresh_token_user_id, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+from responses import FastJSONResponse, FAST_RESPONSES
+from write_buffer import LogWriteBuffer
+from live import LiveHub, sse_event
+from idempotency import IdempotencyMiddleware, IdempotencyStore, purge_idempotency_keys
+from timeseries_cache import create_cache
+from snapshot import export_snapshot
+from ratelimit import RateLimiter, RateLimitMiddleware, MemoryRateLimitStore, RouteLimits
+from schemas import User, UserSignUp, UserLogin, UserUpdate, UserOut, DailyLogInput, DailyLogOutput, MetricType, LogTrendsOut, MetricsSummary, LogMetric, RollingSeriesOut, TrendsBatchInput, TrendsBatchOut, ComparePeriod, TrendsComparisonOut, JobStatusOut, JobRunOut, HashCostStatsOut, TokenOut, RefreshTokenInput, RevokedSessionsOut, GroupTrendsInput, RankOrder
 
+startup_report.mark("imports")
 
 # ------ Logging ------
 # Almacenaremos los logs en un archivo en lugar de verlos por la terminal
 LOG_DIR = "logs"
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
-# Si no existe la carptea logs la creamos
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO) 
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - [%(name)s] - %(message)s")
 
-file_handler = logging.FileHandler(LOG_FILE)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+def setup_logging():
+    """Configura el fichero de logs. Se llama desde el lifespan, no al importar el módulo."""
+    if logger.handlers:
+        return
+    # Si no existe la carptea logs la creamos
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
+
+    logger.setLevel(logging.INFO) 
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - [%(name)s] - %(message)s")
 
-logger.info(f"Sistema de Logging Inicializado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    logger.info(f"Sistema de Logging Inicializado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 # -------------------
 
 #  URL del endpoint que maneja la autenticación y genera el token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-# Creamos la base e datos
-Base.metadata.create_all(bind=engine) 
+# Variante sin error automático para el canal en vivo, que también admite el token como parámetro
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
+# El esquema se crea en el arranque (lifespan), no al importar. Con INIT_DB_ON_STARTUP=0 se omite y
+# se gestiona aparte con `python database.py --init-db` (p.ej. en el despliegue).
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "1") == "1"
+
+# Funciones de agregación SQL para cada tipo de métrica
+AGGREGATE_FUNCS = {
+    MetricType.AVERAGE: func.avg,
+    MetricType.MINIMUM: func.min,
+    MetricType.MAXIMUM: func.max
+}
+# Ventana máxima (en días) admitida en las series móviles
+MAX_ROLLING_WINDOW = 365
 
 # ------ Utilities ------
 def get_current_user(token):
@@ -54,7 +85,7 @@ def get_current_user(token):
     if not user_id:
         logger.warning("Fallo de autenticación: El token sin usuario asociado (sub).")
         raise HTTPException(status_code=401, detail="Token sin identidad")
-    db = SessionLocal()
+    db = get_session(user_id)
     try:
         user = db.query(UserDB).filter(UserDB.id == user_id).first()
         if not user:
@@ -64,6 +95,506 @@ def get_current_user(token):
     finally:
         db.close()
 
+# Emails con acceso a los endpoints de administración (ADMIN_EMAILS, separados por comas)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+def get_admin_user(token):
+    """Verifica el token y que el usuario sea administrador."""
+    user = get_current_user(token)
+    if user.email.lower() not in ADMIN_EMAILS:
+        logger.warning(f"Acceso de administración denegado al usuario {user.id}.")
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador.")
+    return user
+
+# Contadores de la migración de hashes de contraseña al coste configurado
+password_rehash_metrics = {"rehashed": 0, "failed": 0}
+
+def rehash_password(db, user_db: UserDB, raw_password: str):
+    """Vuelve a hashear la contraseña con el coste actual. Un fallo no impide el inicio de sesión."""
+    old_cost = hash_cost(user_db.password_hash)
+    try:
+        user_db.password_hash = hash_password(raw_password)
+        db.commit()
+        password_rehash_metrics["rehashed"] += 1
+        logger.info(f"Hash de contraseña del usuario {user_db.id} actualizado (coste {old_cost} -> {BCRYPT_ROUNDS}).")
+    except Exception as e:
+        db.rollback()
+        password_rehash_metrics["failed"] += 1
+        logger.error(f"Error al actualizar el hash de contraseña del usuario {user_db.id}: {e}")
+
+def password_hash_costs() -> dict:
+    """Número de usuarios por coste de bcrypt, sumando todos los shards."""
+    distribution = {}
+    for session_factory in dict.fromkeys(shard_sessions):
+        db = session_factory()
+        try:
+            # Los hashes bcrypt empiezan por "$2b$<coste>$"
+            prefix = func.substr(UserDB.password_hash, 1, 7)
+            for hash_prefix, count in db.query(prefix, func.count()).group_by(prefix).all():
+                cost = str(hash_cost(hash_prefix + "x") or "unknown")
+                distribution[cost] = distribution.get(cost, 0) + count
+        finally:
+            db.close()
+    return distribution
+
+def bump_data_version(db, user_id: str):
+    """Incrementa la versión de datos del usuario. Se confirma en la misma transacción que la escritura."""
+    db.query(UserDB).filter(UserDB.id == user_id).update({
+        UserDB.data_version: UserDB.data_version + 1,
+        UserDB.updated_at: datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0),
+    }, synchronize_session=False)
+
+def purge_user_data(db, user_id: str):
+    """Borra la cuenta y todos los datos asociados con sentencias DELETE masivas (sin cargar filas en memoria).
+    El borrado explícito de los logs cubre también las bases de datos creadas sin ON DELETE CASCADE."""
+    deleted_logs = db.query(DailyLogDB).filter(DailyLogDB.user_id == user_id).delete(synchronize_session=False)
+    db.query(MonthlyLogSummaryDB).filter(MonthlyLogSummaryDB.user_id == user_id).delete(synchronize_session=False)
+    db.query(RefreshTokenDB).filter(RefreshTokenDB.user_id == user_id).delete(synchronize_session=False)
+    db.query(IdempotencyKeyDB).filter(IdempotencyKeyDB.scope == user_id).delete(synchronize_session=False)
+    db.query(UserDB).filter(UserDB.id == user_id).delete(synchronize_session=False)
+    return deleted_logs
+
+def issue_tokens(db, user_id: str, family_id: Optional[str] = None):
+    """Crea un access token y un refresh token (nueva familia en el login, la misma al rotar).
+    Añade la fila del refresh token a la sesión; el commit lo hace quien llama. El access token lleva
+    la familia (`fam`) para que las conexiones largas puedan comprobar si la sesión se ha revocado.
+    Devuelve la respuesta para el cliente y el hash del nuevo refresh token."""
+    refresh_token = create_refresh_token(user_id)
+    token_hash = hash_refresh_token(refresh_token)
+    family_id = family_id or token_hash
+    now = utcnow()
+    db.add(RefreshTokenDB(
+        token_hash=token_hash, user_id=user_id, family_id=family_id,
+        created_at=now, expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return {
+        "access_token": create_access_token({"sub": user_id, "fam": family_id}),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }, token_hash
+
+def revoke_refresh_tokens(db, *conditions) -> int:
+    """Revoca (UPDATE masivo) los refresh tokens activos que cumplan las condiciones."""
+    return db.query(RefreshTokenDB).filter(RefreshTokenDB.revoked_at.is_(None), *conditions).update(
+        {RefreshTokenDB.revoked_at: utcnow()}, synchronize_session=False
+    )
+
+def session_active(user_id: str, family_id: str) -> bool:
+    """Indica si la familia de refresh tokens sigue teniendo un token vigente (no revocado ni caducado)."""
+    db = get_session(user_id)
+    try:
+        return db.query(RefreshTokenDB.token_hash).filter(
+            RefreshTokenDB.family_id == family_id,
+            RefreshTokenDB.revoked_at.is_(None),
+            RefreshTokenDB.expires_at > utcnow(),
+        ).first() is not None
+    finally:
+        db.close()
+
+def bump_data_versions(db, user_ids):
+    """Incrementa la versión de datos de varios usuarios (commits agrupados del buffer write-behind)."""
+    for user_id in user_ids:
+        bump_data_version(db, user_id)
+
+def user_etag(user: UserDB, *parts) -> str:
+    """ETag débil derivado de la versión de datos del usuario y de los parámetros de la consulta."""
+    raw = ":".join([user.id, str(user.data_version or 0), *map(str, parts)])
+    return 'W/"' + hashlib.sha1(raw.encode()).hexdigest()[:16] + '"'
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Evalúa las cabeceras condicionales. If-None-Match tiene prioridad: If-Modified-Since solo se usa sin él.
+    `updated_at` tiene resolución de segundos y dos escrituras en el mismo segundo comparten valor, así que
+    solo se responde 304 si la última modificación es estrictamente anterior al segundo de la cabecera."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Comparación débil: se ignora el prefijo W/
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc) < since.replace(microsecond=0)
+    return False
+
+def set_cache_headers(response: Response, etag: str, last_modified: Optional[datetime] = None):
+    """Añade ETag/Last-Modified y obliga al cliente a revalidar antes de reutilizar la respuesta.
+    Last-Modified solo se envía si su segundo ya ha terminado (otra escritura en ese segundo no lo cambiaría);
+    si no, basta el ETag, que incluye data_version."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if last_modified is not None and last_modified < datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0):
+        response.headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    """Respuesta 304 sin cuerpo."""
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, last_modified)
+    return response
+
+# Campos de DailyLogOutput en el orden de la respuesta
+LOG_OUTPUT_FIELDS = ["log_date", *(col.name for col in METRIC_COLUMNS), "user_id"]
+
+def log_to_dict(log) -> dict:
+    """Construye la respuesta de un log directamente a partir de la fila (sin releerla tras el commit)."""
+    return {field: getattr(log, field) for field in LOG_OUTPUT_FIELDS}
+
+def respond(content, response: Optional[Response] = None, status_code: int = 200):
+    """En modo FAST_RESPONSES devuelve una FastJSONResponse, evitando la validación del response_model
+    y el codificador JSON estándar. En caso contrario devuelve el contenido tal cual a FastAPI."""
+    if not FAST_RESPONSES:
+        return content
+    headers = None
+    if response is not None:
+        # Conservamos las cabeceras ya fijadas en la respuesta (ETag, Cache-Control...)
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return FastJSONResponse(content=content, status_code=status_code, headers=headers)
+
+# ------ Canal en vivo (Server-Sent Events) ------
+# Tras cada commit de un log se publica el cambio a las conexiones abiertas del usuario
+live_hub = LiveHub(
+    max_queue=int(os.getenv("LIVE_QUEUE_SIZE", 100)),
+    max_subscriptions_per_user=int(os.getenv("LIVE_MAX_STREAMS_PER_USER", 5)),
+)
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", 15))
+
+def publish_log_change(user_id: str, content: dict):
+    """Notifica un log confirmado a los suscriptores del usuario (no hace nada si no hay ninguno)."""
+    live_hub.publish(user_id, {"type": "log", "log": content})
+
+def live_summary(user_id: str, metric_type: MetricType, last_days: int) -> dict:
+    """Resumen que se envía por el canal en vivo (incluye los logs compactados)."""
+    db = get_session(user_id)
+    try:
+        start_date, _ = resolve_period(last_days, None, None)
+        if trends_cache is not None:
+            user = db.get(UserDB, user_id)
+            if user is not None:
+                return cached_summary(db, user, start_date, None, metric_type)
+        return tiered_summary(db, user_id, start_date, None, metric_type)
+    finally:
+        db.close()
+
+# ------ Caché columnar de series por usuario ------
+# Historial de logs diarios de los usuarios activos en arrays numpy (TRENDS_CACHE_MB, LRU).
+# Las tendencias se calculan sobre porciones de esos arrays en lugar de consultar SQLite.
+trends_cache = create_cache()
+
+def load_series_rows(db, user_id: str):
+    """Filas (log_date, métricas...) del usuario ordenadas por fecha, sin construir objetos ORM."""
+    return db.query(DailyLogDB.log_date, *METRIC_COLUMNS).filter(
+        DailyLogDB.user_id == user_id
+    ).order_by(DailyLogDB.log_date).all()
+
+def user_series(db, user: UserDB):
+    """Serie en caché del usuario, validada contra su data_version."""
+    return trends_cache.get(user.id, user.data_version or 0, lambda: load_series_rows(db, user.id))
+
+def cached_summary(db, user: UserDB, start: date, end: Optional[date], metric_type: MetricType) -> dict:
+    """Como `tiered_summary`, pero los logs diarios salen de la caché. El nivel mensual solo se
+    consulta si el período llega a la zona compactada."""
+    hot = user_series(db, user).stats(start, end)
+    cold = archived_stats(db, user.id, start, end) if start < compaction_cutoff() else None
+    return combine_stats(hot, cold, metric_type)
+
+def on_log_committed(user_id: str, content: dict):
+    """Tras el commit de un log en el buffer write-behind: notifica y descarta la serie en caché
+    (el buffer agrupa varias escrituras por versión, así que no se puede parchear)."""
+    if trends_cache is not None:
+        trends_cache.invalidate(user_id)
+    publish_log_change(user_id, content)
+
+def after_log_write(user_db: UserDB, content: dict):
+    """Tras el commit de un log desde la API: parchea la serie en caché y notifica a los suscriptores."""
+    if trends_cache is not None:
+        trends_cache.patch(user_db.id, (user_db.data_version or 0) + 1, content)
+    publish_log_change(user_db.id, content)
+
+# ------ Write-behind de logs (opcional) ------
+# Con LOG_WRITE_BEHIND=1 las escrituras de logs se encolan y se confirman en commits agrupados
+# cada LOG_FLUSH_INTERVAL_MS milisegundos o cada LOG_FLUSH_MAX_ROWS escrituras. Una petición durable
+# espera su commit como máximo LOG_WRITE_TIMEOUT_SECONDS segundos (después responde 503).
+LOG_WRITE_TIMEOUT_SECONDS = float(os.getenv("LOG_WRITE_TIMEOUT_SECONDS", 10))
+log_write_buffer = None
+if os.getenv("LOG_WRITE_BEHIND", "0") == "1":
+    log_write_buffer = LogWriteBuffer(
+        get_session,
+        flush_interval_ms=int(os.getenv("LOG_FLUSH_INTERVAL_MS", 50)),
+        max_batch=int(os.getenv("LOG_FLUSH_MAX_ROWS", 500)),
+        serialize=log_to_dict,
+        before_commit=bump_data_versions,
+        on_commit=on_log_committed,
+    )
+
+def queue_log_write(user_id: str, log_data: DailyLogInput, op: str, durable: bool, status_code: int):
+    """Encola una escritura de log. Si `durable`, espera a su commit; si no, responde 202 al instante."""
+    fields = log_data.model_dump(exclude_none=True, exclude={"log_date"})
+    future = log_write_buffer.submit(user_id, log_data.log_date, op, fields)
+    if not durable:
+        logger.info(f"Log del usuario {user_id} en la fecha {log_data.log_date} encolado ({op}).")
+        return JSONResponse(status_code=202, content={
+            "detail": "Log encolado. Se guardará en el próximo commit agrupado.",
+            "user_id": user_id,
+            "log_date": log_data.log_date.isoformat(),
+        })
+    try:
+        content = future.result(timeout=LOG_WRITE_TIMEOUT_SECONDS)
+    except FuturesTimeoutError:
+        logger.error(f"El commit agrupado del log del usuario {user_id} en la fecha {log_data.log_date} no ha terminado en {LOG_WRITE_TIMEOUT_SECONDS} s ({op}).")
+        raise HTTPException(status_code=503, detail="El log no se ha confirmado a tiempo; puede guardarse más tarde. Comprueba su estado antes de reintentar.")
+    logger.info(f"Log del usuario {user_id} en la fecha {log_data.log_date} guardado en commit agrupado ({op}).")
+    return respond(content, status_code=status_code)
+
+# ------ Tareas programadas ------
+def run_log_compaction():
+    """Compacta en resúmenes mensuales los logs anteriores al horizonte de retención."""
+    compacted = compact_all_shards(before_commit=bump_data_versions)
+    logger.info(f"Compactación programada: {compacted} logs resumidos.")
+
+def purge_refresh_tokens():
+    """Borra de cada shard los refresh tokens caducados (los revocados se conservan hasta caducar
+    para detectar su reutilización)."""
+    purged = 0
+    for session_factory in dict.fromkeys(shard_sessions):
+        db = session_factory()
+        try:
+            purged += db.query(RefreshTokenDB).filter(RefreshTokenDB.expires_at < utcnow()).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al purgar refresh tokens caducados: {e}")
+            raise
+        finally:
+            db.close()
+    logger.info(f"Purga programada: {purged} refresh tokens caducados eliminados.")
+
+def run_idempotency_purge():
+    """Borra las respuestas idempotentes caducadas (y las más antiguas si se supera el máximo)."""
+    purged = purge_idempotency_keys(dict.fromkeys(shard_sessions))
+    logger.info(f"Purga programada: {purged} claves idempotentes eliminadas.")
+
+def optimize_databases():
+    """PRAGMA optimize en la base de datos principal y en cada shard (ANALYZE solo donde haga falta)."""
+    for db_engine in all_engines():
+        if db_engine.dialect.name != "sqlite":
+            continue
+        with db_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA optimize")
+
+def run_snapshot_export():
+    """Snapshot columnar incremental de los logs para los procesos de análisis."""
+    manifest = export_snapshot()
+    logger.info(f"Snapshot programado {manifest['name']}: {manifest['changed_users']} de {manifest['users']} usuarios releídos.")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+# Las reservas de las tareas se guardan en la base de datos principal, compartida por todos los workers
+scheduler = Scheduler(SessionLocal)
+scheduler.add_job("optimize_db", optimize_databases, interval=6 * 3600, jitter=600)
+scheduler.add_job("purge_refresh_tokens", purge_refresh_tokens, interval=24 * 3600, jitter=1800)
+scheduler.add_job("purge_idempotency_keys", run_idempotency_purge, interval=3600, jitter=300)
+# La compactación borra logs diarios: solo se programa si se indica COMPACTION_CRON (p.ej. "30 3 * * *")
+COMPACTION_CRON = os.getenv("COMPACTION_CRON", "")
+if COMPACTION_CRON:
+    scheduler.add_job("compact_logs", run_log_compaction, cron=COMPACTION_CRON, jitter=300)
+# El snapshot para análisis solo se programa si se indica SNAPSHOT_CRON (p.ej. "0 4 * * *")
+SNAPSHOT_CRON = os.getenv("SNAPSHOT_CRON", "")
+if SNAPSHOT_CRON:
+    scheduler.add_job("export_snapshot", run_snapshot_export, cron=SNAPSHOT_CRON, jitter=300)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    if INIT_DB_ON_STARTUP:
+        await asyncio.to_thread(init_db)
+    if log_write_buffer is not None:
+        log_write_buffer.start()
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+    startup_report.mark("app_ready")
+    logger.info(f"Aplicación lista en {startup_report.phases['app_ready']} ms.")
+    yield
+    await scheduler.stop()
+    # Vaciamos la cola de escrituras antes de terminar
+    if log_write_buffer is not None:
+        await asyncio.to_thread(log_write_buffer.stop)
+
+def ensure_not_compacted(db, user_id: str, log_date: date):
+    """Rechaza las escrituras en meses ya compactados: ese día ya está contado en `logs_monthly` y una
+    fila diaria nueva lo contaría dos veces en las tendencias (y otra vez en la siguiente compactación).
+    Los meses antiguos sin resumen (p.ej. sin compactación programada) se pueden rellenar con normalidad."""
+    if is_compacted(db, user_id, log_date):
+        logger.warning(f"Escritura rechazada: el mes del log del usuario {user_id} en {log_date} ya está compactado.")
+        raise HTTPException(status_code=400, detail=compacted_month_detail(log_date))
+
+def resolve_period(last_days: Optional[int], start: Optional[date], end: Optional[date]):
+    """Devuelve el rango (inicio, fin) de una consulta. `last_days` es relativo a hoy; fin None = sin límite."""
+    if last_days is not None:
+        return date.today() - timedelta(days=last_days), None
+    return start, end
+
+def previous_period(start: date, end: date, compare_to: ComparePeriod):
+    """Calcula el período de referencia para una comparación."""
+    if compare_to == ComparePeriod.PREVIOUS_YEAR:
+        def one_year_before(day: date) -> date:
+            try:
+                return day.replace(year=day.year - 1)
+            except ValueError:      # 29 de febrero
+                return day.replace(year=day.year - 1, day=28)
+        return one_year_before(start), one_year_before(end)
+    length = end - start + timedelta(days=1)
+    return start - length, end - length
+
+def tiered_summary(db, user_id: str, start: date, end: Optional[date], metric_type: MetricType) -> dict:
+    """Agrega un período combinando los logs diarios con los resúmenes mensuales de los logs compactados."""
+    stats_columns = []
+    for col in METRIC_COLUMNS:
+        stats_columns += [
+            func.count(col).label(f"{col.name}_count"),
+            func.sum(col).label(f"{col.name}_sum"),
+            func.min(col).label(f"{col.name}_min"),
+            func.max(col).label(f"{col.name}_max"),
+        ]
+    row = db.query(*stats_columns).filter(
+        DailyLogDB.user_id == user_id,
+        period_condition(start, end)
+    ).one()._asdict()
+    hot = {
+        col.name: {stat: row[f"{col.name}_{stat}"] for stat in ("count", "sum", "min", "max")}
+        for col in METRIC_COLUMNS
+    }
+    return combine_stats(hot, archived_stats(db, user_id, start, end), metric_type)
+
+def combine_stats(hot: dict, cold: Optional[dict], metric_type: MetricType) -> dict:
+    """Combina las estadísticas (count, sum, min, max) de los logs diarios y, si se indican, de los
+    resúmenes mensuales, y devuelve la agregación pedida por métrica."""
+    summary = {}
+    for col in METRIC_COLUMNS:
+        name = col.name
+        parts = [hot[name]] + ([cold[name]] if cold is not None else [])
+        count = sum(part["count"] or 0 for part in parts)
+        if not count:
+            summary[name] = None
+        elif metric_type == MetricType.AVERAGE:
+            summary[name] = sum(part["sum"] or 0 for part in parts) / count
+        elif metric_type == MetricType.MINIMUM:
+            summary[name] = min(part["min"] for part in parts if part["min"] is not None)
+        else:
+            summary[name] = max(part["max"] for part in parts if part["max"] is not None)
+    return summary
+
+def period_condition(start: date, end: Optional[date]):
+    """Condición SQL para que un log caiga dentro del rango (ambos extremos incluidos)."""
+    if end is None:
+        return DailyLogDB.log_date >= start
+    return and_(DailyLogDB.log_date >= start, DailyLogDB.log_date <= end)
+
+# Tamaño máximo de cada lista IN en las consultas de grupo (límite de parámetros por sentencia)
+GROUP_TRENDS_CHUNK_SIZE = int(os.getenv("GROUP_TRENDS_CHUNK_SIZE", 500))
+
+def group_stats_subquery(user_filter, start: date, end: Optional[date]):
+    """Días registrados y (count, sum, min, max) por métrica y usuario en el período. Si el período llega
+    a la zona compactada se añaden, con UNION ALL, las mismas estadísticas de los resúmenes mensuales.
+    `user_filter(columna_user_id)` devuelve la condición que selecciona a los usuarios del grupo."""
+    daily_columns = [DailyLogDB.user_id.label("user_id"), func.count().label("days")]
+    for col in METRIC_COLUMNS:
+        daily_columns += [
+            func.count(col).label(f"{col.name}_count"),
+            func.sum(col).label(f"{col.name}_sum"),
+            func.min(col).label(f"{col.name}_min"),
+            func.max(col).label(f"{col.name}_max"),
+        ]
+    daily = select(*daily_columns).where(
+        user_filter(DailyLogDB.user_id), period_condition(start, end)
+    ).group_by(DailyLogDB.user_id)
+    if start >= compaction_cutoff():
+        return daily.subquery()
+
+    monthly_columns = [MonthlyLogSummaryDB.user_id, func.sum(MonthlyLogSummaryDB.days)]
+    for col in METRIC_COLUMNS:
+        monthly_columns += [
+            func.sum(getattr(MonthlyLogSummaryDB, f"{col.name}_count")),
+            func.sum(getattr(MonthlyLogSummaryDB, f"{col.name}_sum")),
+            func.min(getattr(MonthlyLogSummaryDB, f"{col.name}_min")),
+            func.max(getattr(MonthlyLogSummaryDB, f"{col.name}_max")),
+        ]
+    # Misma resolución mensual que archived_stats: un mes cuenta completo si solapa con el período
+    monthly_filters = [user_filter(MonthlyLogSummaryDB.user_id), MonthlyLogSummaryDB.month >= start.replace(day=1)]
+    if end is not None:
+        monthly_filters.append(MonthlyLogSummaryDB.month <= end)
+    monthly = select(*monthly_columns).where(*monthly_filters).group_by(MonthlyLogSummaryDB.user_id)
+    return union_all(daily, monthly).subquery()
+
+def group_trends_query(db, user_filter, start: date, end: Optional[date], metric_type: MetricType,
+                       rank_by: Optional[LogMetric] = None, order: RankOrder = RankOrder.TOP, limit: Optional[int] = None):
+    """Consulta GROUP BY user_id con la agregación pedida por métrica. Con `rank_by` solo se incluyen los
+    usuarios con valor en esa métrica, ordenados en SQL y limitados a `limit` filas."""
+    stats = group_stats_subquery(user_filter, start, end).c
+    metrics = []
+    for col in METRIC_COLUMNS:
+        name = col.name
+        if metric_type == MetricType.AVERAGE:
+            # CAST: en SQLite la división de dos enteros es entera
+            value = cast(func.sum(stats[f"{name}_sum"]), Float) / func.nullif(func.sum(stats[f"{name}_count"]), 0)
+        elif metric_type == MetricType.MINIMUM:
+            value = func.min(stats[f"{name}_min"])
+        else:
+            value = func.max(stats[f"{name}_max"])
+        metrics.append(value.label(name))
+    query = db.query(stats.user_id, func.sum(stats.days).label("days"), *metrics).group_by(stats.user_id)
+    if rank_by is None:
+        return query.order_by(stats.user_id)
+    ranked = next(metric for metric in metrics if metric.name == rank_by.value)
+    direction = ranked.desc() if order == RankOrder.TOP else ranked.asc()
+    return query.having(ranked.isnot(None)).order_by(direction, stats.user_id).limit(limit)
+
+def group_trend_rows(payload: GroupTrendsInput, start: date, end: Optional[date]):
+    """Filas {user_id, days, metrics} del grupo. Los ids se reparten por shard y se consultan en bloques
+    de GROUP_TRENDS_CHUNK_SIZE; el rango de edad se resuelve con una subconsulta sobre `users`."""
+    age_conditions = []
+    if payload.min_age is not None:
+        age_conditions.append(UserDB.age >= payload.min_age)
+    if payload.max_age is not None:
+        age_conditions.append(UserDB.age <= payload.max_age)
+
+    def user_filter_for(chunk: Optional[List[str]]):
+        def user_filter(user_id_column):
+            conditions = []
+            if chunk is not None:
+                conditions.append(user_id_column.in_(chunk))
+            if age_conditions:
+                conditions.append(user_id_column.in_(select(UserDB.id).where(*age_conditions)))
+            return and_(*conditions)
+        return user_filter
+
+    for session_factory, chunk in shard_batches(payload.user_ids, GROUP_TRENDS_CHUNK_SIZE):
+        db = session_factory()
+        try:
+            query = group_trends_query(
+                db, user_filter_for(chunk), start, end, payload.metric_type,
+                payload.rank_by, payload.order, payload.limit,
+            )
+            for row in query.yield_per(GROUP_TRENDS_CHUNK_SIZE):
+                yield {
+                    "user_id": row.user_id,
+                    "days": row.days,
+                    "metrics": {col.name: getattr(row, col.name) for col in METRIC_COLUMNS},
+                }
+        finally:
+            db.close()
+
+def rank_group_rows(rows, rank_by: LogMetric, order: RankOrder, limit: int) -> list:
+    """Une los rankings parciales (uno por bloque y shard) en el ranking final del grupo."""
+    sign = -1 if order == RankOrder.TOP else 1
+    ranked = heapq.nsmallest(limit, rows, key=lambda row: (sign * row["metrics"][rank_by.value], row["user_id"]))
+    return [{"rank": position, **row} for position, row in enumerate(ranked, start=1)]
+
 from textwrap import dedent
 ## ------ API setup ------ 
 app = FastAPI(
@@ -89,7 +620,59 @@ app = FastAPI(
     ---
 
     """), 
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+app.add_middleware(FirstRequestTimer)
+
+def account_from_body(body: bytes) -> Optional[str]:
+    """Id de la cuenta del email del cuerpo (registro e inicio de sesión), o None si no lo hay. Sirve de
+    scope de las claves de idempotencia del registro y para repartir por cuenta el límite por IP del login."""
+    try:
+        email = json.loads(body).get("email")
+    except (ValueError, AttributeError):
+        return None
+    return generate_user_id(email) if isinstance(email, str) and email else None
+
+# ------ Control de admisión ------
+# Clases de rutas: el hash de contraseñas (bcrypt) y las agregaciones son caros; las escrituras
+# tienen su propio cupo para que una avalancha de consultas no impida registrar logs.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+rate_limiter = RateLimiter(
+    MemoryRateLimitStore(),
+    {
+        "auth-hash": RouteLimits("auth-hash", ip_rate=0.5, ip_burst=30, max_concurrency=max(2, os.cpu_count() or 2), queue_timeout=2),
+        "analytics": RouteLimits("analytics", ip_rate=10, ip_burst=40, user_rate=2, user_burst=20, max_concurrency=8, queue_timeout=1),
+        "writes": RouteLimits("writes", ip_rate=20, ip_burst=100, user_rate=10, user_burst=50, max_concurrency=16, queue_timeout=2),
+    },
+    {
+        ("POST", "/auth/signup"): "auth-hash",
+        ("POST", "/auth/login"): "auth-hash",
+        ("GET", "/user/trends"): "analytics",
+        ("GET", "/user/trends/rolling"): "analytics",
+        ("POST", "/user/trends/batch"): "analytics",
+        ("POST", "/admin/trends/group"): "analytics",
+        ("POST", "/user/logs"): "writes",
+        ("PUT", "/user/logs"): "writes",
+        ("PUT", "/user/account"): "writes",
+        ("DELETE", "/user/account"): "writes",
+    },
+    trust_proxy_headers=os.getenv("TRUST_PROXY_HEADERS", "0") == "1",
+    # El bucket por IP de signup/login es por (IP, cuenta): con un proxy delante no lo comparten todos
+    body_subjects={"/auth/signup": account_from_body, "/auth/login": account_from_body},
+)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# ------ Idempotency-Key ------
+# Los reintentos con la misma clave reproducen la respuesta guardada. Se añade después del control
+# de admisión para envolverlo: un reintento reproducido no consume cupo.
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=IdempotencyStore(get_session),
+    routes={("POST", "/user/logs"), ("PUT", "/user/logs"), ("POST", "/auth/signup")},
+    authenticated_paths={"/user/logs"},
+    body_scopes={"/auth/signup": account_from_body},
 )
 
 
@@ -108,7 +691,9 @@ app = FastAPI(
     }
     )
 def create_user(payload : UserSignUp):
-    db = SessionLocal()
+    # El id se deriva del email, por lo que también determina el shard del usuario
+    user_id = generate_user_id(payload.email)
+    db = get_session(user_id)
     try: 
         # Comprobamos si ya existe el usuario
         logger.info(f"Attempting to sign up user: {payload.email}") 
@@ -119,7 +704,7 @@ def create_user(payload : UserSignUp):
         
         # Creamos el usuario
         user_db = UserDB(
-            id = generate_user_id(payload.email), 
+            id = user_id, 
             name=payload.name, 
             age=payload.age, 
             email=payload.email,
@@ -141,7 +726,8 @@ def create_user(payload : UserSignUp):
 # ----- Inicio de sesión: Login ------
 @app.post(
     "/auth/login",
-    summary="Inicio de sesión y obtención de token.",
+    response_model=TokenOut,
+    summary="Inicio de sesión y obtención de tokens (access token y refresh token).",
     status_code=200,
     tags=["Authentication"],
     responses={
@@ -151,7 +737,9 @@ def create_user(payload : UserSignUp):
                 "application/json": {
                     "example": {
                         "access_token": "eyJhbGciOiJIUzI1Ni…",
-                        "token_type": "bearer"
+                        "token_type": "bearer",
+                        "refresh_token": "4826b74da7.Xq3v…",
+                        "expires_in": 1800
                     }
                 }
             }
@@ -162,7 +750,7 @@ def create_user(payload : UserSignUp):
 )
 
 def login_user(payload: UserLogin ):
-    db= SessionLocal()
+    db= get_session(generate_user_id(payload.email))
     try:
         #Comprobamos que existe el ususario
         user_db = db.query(UserDB).filter(UserDB.email == payload.email).first()
@@ -171,10 +759,14 @@ def login_user(payload: UserLogin ):
             raise HTTPException(status_code=400, detail="Usuario no encontrado.")
         if not verify_password(payload.password, user_db.password_hash):
             raise HTTPException(status_code=400, detail="Contraseña incorrecta.")
-        # Si existe creamos un token
-        token = create_access_token({"sub": user_db.id})
+        # Tras verificar, migramos el hash al coste configurado (BCRYPT_ROUNDS) si es distinto
+        if password_needs_rehash(user_db.password_hash):
+            rehash_password(db, user_db, payload.password)
+        # Si existe creamos los tokens (cada login abre una nueva familia de refresh tokens)
+        tokens, _ = issue_tokens(db, user_db.id)
+        db.commit()
         logger.info(f"Usuario {user_db.email} ha iniciado sesión correctamente.")
-        return {"access_token": token, "token_type": "bearer"}
+        return tokens
     except Exception as e:
         logger.error(f"Error durante el inicio de sesión para {payload.email}: {e}")
         raise
@@ -182,7 +774,111 @@ def login_user(payload: UserLogin ):
         db.close()
     
 
-### Endpoints de usuario: GET, PUT 
+# ----- Renovación de tokens: Refresh ------
+@app.post(
+    "/auth/refresh",
+    response_model=TokenOut,
+    summary="Obtiene un nuevo access token a partir de un refresh token (sin verificar la contraseña).",
+    tags=["Authentication"],
+    responses={
+        200 : {"description": "Tokens renovados. El refresh token enviado queda revocado y se devuelve otro."},
+        401 : {"description": "Refresh token inválido, caducado o revocado."}
+    }
+)
+def refresh_tokens(payload: RefreshTokenInput):
+    user_id = refresh_token_user_id(payload.refresh_token)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Refresh token inválido.")
+    db = get_session(user_id)
+    try:
+        token_hash = hash_refresh_token(payload.refresh_token)
+        stored = db.get(RefreshTokenDB, token_hash)
+        if stored is None or stored.user_id != user_id:
+            raise HTTPException(status_code=401, detail="Refresh token inválido.")
+        if stored.revoked_at is not None:
+            if stored.replaced_by is not None:
+                # Reutilización de un token ya rotado: posible robo. Revocamos toda la familia.
+                revoked = revoke_refresh_tokens(db, RefreshTokenDB.family_id == stored.family_id)
+                db.commit()
+                logger.warning(f"Reutilización de refresh token del usuario {user_id}: {revoked} tokens de la familia revocados.")
+            raise HTTPException(status_code=401, detail="Refresh token revocado.")
+        if stored.expires_at < utcnow():
+            raise HTTPException(status_code=401, detail="Refresh token caducado.")
+        # Rotación: la revocación es condicional para que dos peticiones simultáneas no roten el mismo token
+        tokens, new_hash = issue_tokens(db, user_id, family_id=stored.family_id)
+        rotated = db.query(RefreshTokenDB).filter(
+            RefreshTokenDB.token_hash == token_hash, RefreshTokenDB.revoked_at.is_(None)
+        ).update({RefreshTokenDB.revoked_at: utcnow(), RefreshTokenDB.replaced_by: new_hash}, synchronize_session=False)
+        if rotated != 1:
+            db.rollback()
+            raise HTTPException(status_code=401, detail="Refresh token revocado.")
+        db.commit()
+        logger.info(f"Tokens renovados para el usuario {user_id}.")
+        return tokens
+    except Exception as e:
+        logger.error(f"Error al renovar los tokens del usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
+# ----- Cierre de sesión ------
+@app.post(
+    "/auth/logout",
+    response_model=RevokedSessionsOut,
+    summary="Revoca el refresh token indicado y todos los de su cadena de rotación.",
+    tags=["Authentication"],
+    responses={
+        200 : {"description": "Sesión cerrada."},
+        401 : {"description": "Refresh token inválido."}
+    }
+)
+def logout(payload: RefreshTokenInput):
+    user_id = refresh_token_user_id(payload.refresh_token)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Refresh token inválido.")
+    db = get_session(user_id)
+    try:
+        stored = db.get(RefreshTokenDB, hash_refresh_token(payload.refresh_token))
+        if stored is None or stored.user_id != user_id:
+            raise HTTPException(status_code=401, detail="Refresh token inválido.")
+        revoked = revoke_refresh_tokens(db, RefreshTokenDB.family_id == stored.family_id)
+        db.commit()
+        logger.info(f"Sesión cerrada para el usuario {user_id} ({revoked} tokens revocados).")
+        return {"revoked": revoked}
+    except Exception as e:
+        logger.error(f"Error al cerrar la sesión del usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
+# ----- Revocación de todas las sesiones ------
+@app.delete(
+    "/user/sessions",
+    response_model=RevokedSessionsOut,
+    summary="Revoca todos los refresh tokens del usuario (cierra la sesión en todos los dispositivos).",
+    tags=["Authentication"],
+    responses={
+        200 : {"description": "Sesiones revocadas. Los access tokens emitidos caducan en ACCESS_TOKEN_EXPIRE_MINUTES."},
+        401 : {"description" : "Token inválido o expirado."}
+    }
+)
+def revoke_sessions(token: str = Depends(oauth2_scheme)):
+    user_id = get_current_user(token).id
+    db = get_session(user_id)
+    try:
+        revoked = revoke_refresh_tokens(db, RefreshTokenDB.user_id == user_id)
+        db.commit()
+        logger.info(f"Revocadas {revoked} sesiones del usuario {user_id}.")
+        return {"revoked": revoked}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error al revocar las sesiones del usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
+
+### Endpoints de usuario: GET, PUT, DELETE 
 # ----- Consultar datos de usuario ------
 @app.get(
     "/user/account",
@@ -191,20 +887,22 @@ def login_user(payload: UserLogin ):
     tags=["User Profile"],
     responses = {
         200 : {"description" : "Datos de usuario devueltos exitosamente."},
+        304 : {"description" : "Los datos no han cambiado desde la versión indicada en If-None-Match / If-Modified-Since."},
         401 : {"description" : "Token inválido o expirado."}
     }
 )
-def get_user(token: str = Depends(oauth2_scheme)):
-    db = SessionLocal()
+def get_user(request: Request, response: Response, token: str = Depends(oauth2_scheme)):
     try: 
         user_db = get_current_user(token)
         # Las validaciones se realizan en  get_current_user()
-        return user_db
+        etag = user_etag(user_db, "account")
+        if is_not_modified(request, etag, user_db.updated_at):
+            return not_modified_response(etag, user_db.updated_at)
+        set_cache_headers(response, etag, user_db.updated_at)
+        return respond({"id": user_db.id, "name": user_db.name, "age": user_db.age, "email": user_db.email}, response)
     except Exception as e:
         logger.error(f"Error al recuperar la cuenta de usuario: {e}")
         raise
-    finally:
-        db.close() 
    
 # ----- Modificar datos de usuario ------
 @app.put(
@@ -218,9 +916,10 @@ def get_user(token: str = Depends(oauth2_scheme)):
     }
 )
 def update_user(payload: UserUpdate, token: str = Depends(oauth2_scheme)):
-    db = SessionLocal()
-    try: 
-        user_db_detached = get_current_user(token)
+    user_db_detached = get_current_user(token)
+    user_id = user_db_detached.id
+    db = get_session(user_id)
+    try:
         user_db_persistent = db.merge(user_db_detached)
         # user_db_detached es una copia de los datos del usuario 
         # hacemos merge para sincronizar el estado del objeto con la bd 
@@ -231,6 +930,8 @@ def update_user(payload: UserUpdate, token: str = Depends(oauth2_scheme)):
             user_db_persistent.name = payload.name 
         if payload.age is not None:
             user_db_persistent.age = payload.age
+        db.flush()
+        bump_data_version(db, user_id)
 
         db.commit()                         # Confirmamos cambios
         db.refresh(user_db_persistent)      # Actualizamos el objeto     
@@ -243,6 +944,40 @@ def update_user(payload: UserUpdate, token: str = Depends(oauth2_scheme)):
     finally:
         db.close() 
 
+# ----- Eliminar cuenta de usuario ------
+@app.delete(
+    "/user/account",
+    status_code=204,
+    summary="Eliminar la cuenta de usuario y todos sus datos asociados.",
+    tags=["User Profile"],
+    responses={
+        204 : {"description" : "Cuenta y datos eliminados exitosamente."},
+        401 : {"description" : "Token inválido o expirado."}
+    }
+)
+def delete_user(token: str = Depends(oauth2_scheme)):
+    user_db = get_current_user(token)
+    user_id = user_db.id
+    db = get_session(user_id)
+    try:
+        # Las escrituras aún no confirmadas del usuario se descartan
+        if log_write_buffer is not None:
+            log_write_buffer.discard_user(user_id)
+
+        deleted_logs = purge_user_data(db, user_id)
+        db.commit()
+        live_hub.close_user(user_id)
+        if trends_cache is not None:
+            trends_cache.invalidate(user_id)
+        logger.info(f"Cuenta del ID de usuario {user_id} eliminada junto con {deleted_logs} logs.")
+        return Response(status_code=204)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error al eliminar la cuenta del ID de usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
 ### Endpoint de logs: 
 #  -- POST /logs ---  
 @app.post(
@@ -253,6 +988,7 @@ def update_user(payload: UserUpdate, token: str = Depends(oauth2_scheme)):
     tags=["Daily Logs"],
     responses={
         201 : {"description": "Log diario creado exitosamente."},
+        202 : {"description": "Log encolado (modo write-behind con `durable=false`)."},
         401 : {"description" : "Token inválido o expirado."},
         400: {
             "description": "Ya existe un log para la fecha especificada.",
@@ -264,11 +1000,18 @@ def update_user(payload: UserUpdate, token: str = Depends(oauth2_scheme)):
         }
     }
 )
-def insert_daily_log(log_data: DailyLogInput, token : str = Depends(oauth2_scheme)):
-    db = SessionLocal()
-    try: 
-        user_db = get_current_user(token)
-        user_id = user_db.id
+def insert_daily_log(
+    log_data: DailyLogInput,
+    durable: bool = Query(True, description="En modo write-behind: esperar al commit (true) o responder 202 al encolar (false)."),
+    token : str = Depends(oauth2_scheme)
+):
+    user_db = get_current_user(token)
+    user_id = user_db.id
+    db = get_session(user_id)
+    try:
+        ensure_not_compacted(db, user_id, log_data.log_date)
+        if log_write_buffer is not None:
+            return queue_log_write(user_id, log_data, "insert", durable, status_code=201)
 
         log_date = log_data.log_date
 
@@ -287,10 +1030,12 @@ def insert_daily_log(log_data: DailyLogInput, token : str = Depends(oauth2_schem
         )
 
         db.add(new_log)
+        bump_data_version(db, user_id)
+        content = log_to_dict(new_log)
         db.commit()
-        db.refresh(new_log)
+        after_log_write(user_db, content)
         logger.info(f"Nuevo log diario creado para el usuario {user_id} en la fecha {log_date}.")
-        return new_log
+        return respond(content, status_code=201)
     except Exception as e:
         db.rollback()
         logger.error(f"Error al insertar el log diario para el usuario {user_id}: {e}")
@@ -306,6 +1051,7 @@ def insert_daily_log(log_data: DailyLogInput, token : str = Depends(oauth2_schem
     tags=["Daily Logs"],
     responses={
         200: {"description": "Log diario actualizado exitosamente."},
+        202 : {"description": "Actualización encolada (modo write-behind con `durable=false`)."},
         401 : {"description" : "Token inválido o expirado."},
         400: {
             "description": "No existe un log en la fecha especificada.",
@@ -317,11 +1063,19 @@ def insert_daily_log(log_data: DailyLogInput, token : str = Depends(oauth2_schem
         }
     }
 )
-def update_daily_log(log_data:DailyLogInput, token : str = Depends(oauth2_scheme)): 
-    db = SessionLocal()
-    try: 
-        user_db = get_current_user(token)
-        user_id = user_db.id
+def update_daily_log(
+    log_data:DailyLogInput,
+    durable: bool = Query(True, description="En modo write-behind: esperar al commit (true) o responder 202 al encolar (false)."),
+    token : str = Depends(oauth2_scheme)
+): 
+    user_db = get_current_user(token)
+    user_id = user_db.id
+    db = get_session(user_id)
+    log_date = log_data.log_date
+    try:
+        ensure_not_compacted(db, user_id, log_date)
+        if log_write_buffer is not None:
+            return queue_log_write(user_id, log_data, "update", durable, status_code=200)
         log_date = log_data.log_date
 
         # Comprobamos que exista el log que se desea modificar (para ese user y dia)
@@ -340,11 +1094,13 @@ def update_daily_log(log_data:DailyLogInput, token : str = Depends(oauth2_scheme
             # Excluimos la fecha --> 'log_date' de ser actualizada ya que es primery_key del registro
             if key not in ['log_date']:
                 setattr(log_db, key, value)
+        bump_data_version(db, user_id)
+        content = log_to_dict(log_db)
 
         db.commit()
-        db.refresh(log_db)
+        after_log_write(user_db, content)
         logger.info(f"Log diario para el usuario {user_id} en la fecha {log_date} actualizado.")
-        return log_db
+        return respond(content)
     except Exception as e:
         db.rollback()
         logger.error(f"Error al actualizar el log diario para el usuario {user_id} en {log_date}: {e}")
@@ -356,13 +1112,15 @@ def update_daily_log(log_data:DailyLogInput, token : str = Depends(oauth2_scheme
 ### Consultas: GET /trends.
 @app.get(
     "/user/trends",
-    response_model=MetricsSummary,
-    summary="Calculo de métrica especificada para un período de tiempo especificado (máximo 30 días atrás).",
+    response_model=Union[MetricsSummary, TrendsComparisonOut],
+    summary="Calculo de métrica especificada para los últimos X días o un rango de fechas, con comparación opcional.",
     tags=["Trends"],
     responses={
-        200 : {"description": "Métricas devueltas exitosamente."},
+        200 : {"description": "Métricas devueltas exitosamente. Con `compare_to` se devuelven ambos períodos y sus diferencias."},
+        304 : {"description": "Los datos no han cambiado desde el ETag indicado en If-None-Match."},
         401 : {"description" : "Token inválido o expirado."},
-        400: {
+        400 : {"description": "Período no válido."},
+        404: {
             "description": "No se encontraron datos para el período de tiempo especificado.",
             "content": {
                 "application/json": {
@@ -372,51 +1130,540 @@ def update_daily_log(log_data:DailyLogInput, token : str = Depends(oauth2_scheme
         }
     }
 )
-def get_log_trends(last_days: int ,metric_type: MetricType, token : str= Depends(oauth2_scheme)):
-    db = SessionLocal()
+def get_log_trends(
+    request: Request,
+    response: Response,
+    metric_type: MetricType,
+    last_days: Optional[int] = Query(None, ge=0, description="Número de días hacia atrás desde hoy."),
+    start: Optional[date] = Query(None, description="Fecha inicial del rango (incluida). Alternativa a `last_days`."),
+    end: Optional[date] = Query(None, description="Fecha final del rango (incluida). Por defecto, hoy."),
+    compare_to: Optional[ComparePeriod] = Query(None, description="Compara con el período anterior o con el mismo período del año anterior."),
+    token : str= Depends(oauth2_scheme)
+):
+    user = get_current_user(token)
+    user_id = user.id
+    db = get_session(user_id)
     try:
-        user = get_current_user(token) 
-        user_id = user.id
+
+        if last_days is None and start is None:
+            raise HTTPException(status_code=400, detail="Debe indicarse 'last_days' o un rango con 'start'.")
+        if last_days is not None and (start is not None or end is not None):
+            raise HTTPException(status_code=400, detail="'last_days' no puede combinarse con 'start'/'end'.")
+        start_date, end_date = resolve_period(last_days, start, end)
+        if end_date is not None and start_date > end_date:
+            raise HTTPException(status_code=400, detail="La fecha inicial debe ser anterior o igual a la final.")
+
+        # Si los datos del usuario no han cambiado evitamos la consulta de agregación
+        etag = user_etag(user, "trends", metric_type.value, last_days, start, end, compare_to, date.today())
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        set_cache_headers(response, etag)
         
-        func_map = {
-            MetricType.AVERAGE: func.avg,
-            MetricType.MINIMUM: func.min,
-            MetricType.MAXIMUM: func.max
-        }
-        selected_func = func_map[metric_type]
-
-        today = date.today()
-        start_date = today - timedelta(days=last_days)
-
-        metric_columns = [
-            DailyLogDB.steps,
-            DailyLogDB.exercise_minutes,
-            DailyLogDB.sleep_hours,
-            DailyLogDB.water_liters,
-            DailyLogDB.diet_score,
-            DailyLogDB.mood,
-        ]
+        selected_func = AGGREGATE_FUNCS[metric_type]
         # Ej: [func.avg(DailyLogDB.steps).label('steps'), func.avg(DailyLogDB.mood).label('mood'), ...]
-        selected_metrics = [selected_func(col).label(col.name) for col in metric_columns]
+        selected_metrics = [selected_func(col).label(col.name) for col in METRIC_COLUMNS]
+        in_current = period_condition(start_date, end_date)
 
-        # 5. Ejecutar la consulta de agregación
-        trends_query = db.query(*selected_metrics).filter(
-            DailyLogDB.user_id == user_id,
-            DailyLogDB.log_date >= start_date
-        ).one_or_none()
+        if compare_to is None and trends_cache is not None:
+            # Agregación sobre la serie en caché (más el nivel mensual si el período llega a él)
+            trends_data = cached_summary(db, user, start_date, end_date, metric_type)
+            if all(value is None for value in trends_data.values()):
+                logger.info(f"No se encontraron registros para el usuario {user_id} desde {start_date}.")
+                raise HTTPException(
+                    status_code=404,
+                    detail="No se encontraron registros de hábitos para el período consultado."
+                )
+            logger.info(f"Tendencias calculadas (caché) para el usuario {user_id} ({metric_type.value} desde {start_date}).")
+            return respond(trends_data, response)
+
+        if compare_to is None and start_date < compaction_cutoff():
+            # El período llega a la zona compactada: combinamos logs diarios y resúmenes mensuales
+            trends_data = tiered_summary(db, user_id, start_date, end_date, metric_type)
+            if all(value is None for value in trends_data.values()):
+                logger.info(f"No se encontraron registros para el usuario {user_id} desde {start_date}.")
+                raise HTTPException(
+                    status_code=404,
+                    detail="No se encontraron registros de hábitos para el período consultado."
+                )
+            logger.info(f"Tendencias calculadas (con logs compactados) para el usuario {user_id} ({metric_type.value} desde {start_date}).")
+            return respond(trends_data, response)
+
+        if compare_to is None:
+            # 5. Ejecutar la consulta de agregación
+            trends_query = db.query(*selected_metrics).filter(
+                DailyLogDB.user_id == user_id,
+                in_current
+            ).one_or_none()
+
+            if not trends_query or all(value is None for value in trends_query):
+                logger.info(f"No se encontraron registros para el usuario {user_id} desde {start_date}.")
+                raise HTTPException(
+                    status_code=404,
+                    detail="No se encontraron registros de hábitos para el período consultado."
+                )
+            trends_data = trends_query._asdict()
+            logger.info(f"Tendencias calculadas exitosamente para el usuario {user_id} ({metric_type.value} desde {start_date}).")
+            return respond(trends_data, response)
 
-        if not trends_query or all(value is None for value in trends_query):
-            logger.info(f"No se encontraron registros para el usuario {user_id} en los últimos {last_days} días.")
+        end_date = end_date or date.today()
+        prev_start, prev_end = previous_period(start_date, end_date, compare_to)
+        if trends_cache is not None:
+            current = cached_summary(db, user, start_date, end_date, metric_type)
+            previous = cached_summary(db, user, prev_start, prev_end, metric_type)
+        elif prev_start < compaction_cutoff():
+            # El período de referencia llega a la zona compactada: se combinan ambos niveles
+            current = tiered_summary(db, user_id, start_date, end_date, metric_type)
+            previous = tiered_summary(db, user_id, prev_start, prev_end, metric_type)
+        else:
+            # Comparación: ambos períodos en una única consulta con agregados condicionales. Con rangos de
+            # más de un año los períodos se solapan y un mismo log cuenta en los dos, como en la caché
+            in_previous = period_condition(prev_start, prev_end)
+            row = db.query(
+                *(selected_func(case((in_current, col))).label(f"current_{col.name}") for col in METRIC_COLUMNS),
+                *(selected_func(case((in_previous, col))).label(f"previous_{col.name}") for col in METRIC_COLUMNS),
+            ).filter(
+                DailyLogDB.user_id == user_id,
+                or_(in_current, in_previous)
+            ).one()
+            current = {col.name: getattr(row, f"current_{col.name}") for col in METRIC_COLUMNS}
+            previous = {col.name: getattr(row, f"previous_{col.name}") for col in METRIC_COLUMNS}
+
+        if all(value is None for value in (*current.values(), *previous.values())):
+            logger.info(f"No se encontraron registros para el usuario {user_id} en {start_date}..{end_date} ni en el período de referencia.")
             raise HTTPException(
                 status_code=404,
                 detail="No se encontraron registros de hábitos para el período consultado."
             )
-        trends_data = trends_query._asdict()
-        logger.info(f"Tendencias calculadas exitosamente para el usuario {user_id} ({metric_type.value} sobre {last_days} días).")
-        return trends_data
+
+        delta, delta_pct = {}, {}
+        for name in current:
+            cur_value, prev_value = current[name], previous[name]
+            if cur_value is None or prev_value is None:
+                delta[name] = delta_pct[name] = None
+                continue
+            delta[name] = cur_value - prev_value
+            delta_pct[name] = (cur_value - prev_value) / prev_value * 100 if prev_value else None
+        logger.info(f"Comparación de tendencias calculada para el usuario {user_id} ({metric_type.value}, {compare_to.value}).")
+        return respond({
+            "metric_type": metric_type,
+            "current": {"start": start_date, "end": end_date, "metrics": current},
+            "previous": {"start": prev_start, "end": prev_end, "metrics": previous},
+            "delta": delta,
+            "delta_pct": delta_pct,
+        }, response)
     except Exception as e:
         logger.error(f"Error al recuperar tendencias de log para el usuario {user_id}: {e}")
         raise
     finally:
-        db.close() 
+        db.close()
+
+
+# ----- Canal en vivo: GET /trends/stream ------
+@app.get(
+    "/user/trends/stream",
+    summary="Canal Server-Sent Events con los logs guardados y el resumen recalculado (sustituye al polling de /user/trends).",
+    tags=["Trends"],
+    response_class=StreamingResponse,
+    responses={
+        200 : {"description": "Flujo `text/event-stream` con eventos `summary` (al conectar y tras cada cambio) y `log` (cada log guardado)."},
+        401 : {"description" : "Token inválido o expirado."},
+        429 : {"description" : "El usuario ya tiene demasiadas conexiones abiertas."}
+    }
+)
+async def stream_trends(
+    request: Request,
+    metric_type: MetricType = Query(MetricType.AVERAGE, description="Agregación del resumen."),
+    last_days: int = Query(7, ge=0, description="Período del resumen: número de días hacia atrás desde hoy."),
+    access_token: Optional[str] = Query(None, description="Token de acceso (EventSource no permite enviar la cabecera Authorization)."),
+    token: Optional[str] = Depends(optional_oauth2_scheme)
+):
+    token = token or access_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    user_id = (await asyncio.to_thread(get_current_user, token)).id
+    # El token solo se valida al conectar: el flujo se cierra cuando caduca o cuando se revoca su sesión
+    claims = decode_access_token(token)
+    expires_at, family_id = claims.get("exp"), claims.get("fam")
+    subscription = live_hub.subscribe(user_id)
+    if subscription is None:
+        raise HTTPException(status_code=429, detail="Demasiadas conexiones abiertas para este usuario.")
+    logger.info(f"Canal en vivo abierto para el usuario {user_id}.")
+
+    async def summary_event() -> str:
+        metrics = await asyncio.to_thread(live_summary, user_id, metric_type, last_days)
+        return sse_event("summary", {
+            "metric_type": metric_type.value, "last_days": last_days,
+            "metrics": metrics, "dropped": subscription.dropped,
+        })
+
+    async def events():
+        try:
+            yield await summary_event()
+            while not subscription.closed and not await request.is_disconnected():
+                timeout = LIVE_KEEPALIVE_SECONDS
+                if expires_at is not None:
+                    timeout = max(0, min(timeout, expires_at - time.time()))
+                batch = await subscription.next_batch(timeout)
+                if expires_at is not None and time.time() >= expires_at:
+                    logger.info(f"Canal en vivo del usuario {user_id} cerrado: el token de acceso ha caducado.")
+                    yield sse_event("closed", {"detail": "El token de acceso ha caducado."})
+                    return
+                if not batch:
+                    if subscription.closed:
+                        continue
+                    if family_id is not None and not await asyncio.to_thread(session_active, user_id, family_id):
+                        logger.info(f"Canal en vivo del usuario {user_id} cerrado: la sesión se ha revocado.")
+                        yield sse_event("closed", {"detail": "La sesión se ha cerrado."})
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                for event in batch:
+                    yield sse_event("log", event["log"])
+                # Varios cambios seguidos se resumen con un único recálculo
+                yield await summary_event()
+            if subscription.closed:
+                yield sse_event("closed", {"detail": "La cuenta del usuario ha sido eliminada."})
+        except Exception as e:
+            logger.error(f"Error en el canal en vivo del usuario {user_id}: {e}")
+            raise
+        finally:
+            live_hub.unsubscribe(subscription)
+            logger.info(f"Canal en vivo cerrado para el usuario {user_id}.")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",      # Evita que un proxy nginx acumule los eventos
+    })
+
+
+# ----- Series móviles: GET /trends/rolling ------
+@app.get(
+    "/user/trends/rolling",
+    response_model=RollingSeriesOut,
+    summary="Series de medias móviles (y mín/máx móviles) de las métricas elegidas en un rango de fechas.",
+    tags=["Trends"],
+    responses={
+        200 : {"description": "Series devueltas exitosamente."},
+        304 : {"description": "Los datos no han cambiado desde el ETag indicado en If-None-Match."},
+        401 : {"description" : "Token inválido o expirado."},
+        400 : {"description": "Rango de fechas o ventanas no válidos."},
+        404: {
+            "description": "No se encontraron datos para el período de tiempo especificado.",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "No se encontraron registros de hábitos para el período consultado."}
+                }
+            }
+        }
+    }
+)
+def get_rolling_trends(
+    request: Request,
+    response: Response,
+    start: date,
+    metrics: List[LogMetric] = Query(..., description="Métricas a suavizar."),
+    end: Optional[date] = Query(None, description="Fecha final (incluida). Por defecto, hoy."),
+    windows: List[int] = Query([7, 28], description="Tamaños de ventana en días naturales."),
+    stats: List[MetricType] = Query([MetricType.AVERAGE], description="Agregaciones a calcular en cada ventana."),
+    token : str= Depends(oauth2_scheme)
+):
+    user = get_current_user(token)
+    user_id = user.id
+    db = get_session(user_id)
+    try:
+
+        end = end or date.today()
+        if start > end:
+            raise HTTPException(status_code=400, detail="La fecha inicial debe ser anterior o igual a la final.")
+        if any(w < 1 or w > MAX_ROLLING_WINDOW for w in windows):
+            raise HTTPException(status_code=400, detail=f"Las ventanas deben estar entre 1 y {MAX_ROLLING_WINDOW} días.")
+        windows = sorted(set(windows))
+
+        etag = user_etag(user, "rolling", start, end, metrics, windows, stats)
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        set_cache_headers(response, etag)
+
+        # La ventana se define sobre días naturales (RANGE sobre el día juliano), no sobre filas,
+        # por lo que los días sin registro no desplazan la ventana. SQLite la calcula en una sola pasada.
+        day_number = func.julianday(DailyLogDB.log_date)
+        window_columns = []
+        for metric in metrics:
+            column = getattr(DailyLogDB, metric.value)
+            for window in windows:
+                for stat in stats:
+                    window_columns.append(
+                        AGGREGATE_FUNCS[stat](column)
+                        .over(order_by=day_number, range_=(-(window - 1), 0))
+                        .label(f"{stat.value}_{metric.value}_{window}d")
+                    )
+
+        # Leemos también los días previos a `start` que necesita la ventana más larga
+        lookback_start = start - timedelta(days=windows[-1] - 1)
+        rolling = db.query(DailyLogDB.log_date, *window_columns).filter(
+            DailyLogDB.user_id == user_id,
+            DailyLogDB.log_date >= lookback_start,
+            DailyLogDB.log_date <= end
+        ).subquery()
+        rows = db.query(rolling).filter(rolling.c.log_date >= start).order_by(rolling.c.log_date).all()
+
+        if not rows:
+            logger.info(f"No se encontraron registros para el usuario {user_id} entre {start} y {end}.")
+            raise HTTPException(
+                status_code=404,
+                detail="No se encontraron registros de hábitos para el período consultado."
+            )
+        series_names = [col.name for col in window_columns]
+        logger.info(f"Series móviles calculadas para el usuario {user_id} ({len(rows)} días, {len(series_names)} series).")
+        return respond({
+            "start": start,
+            "end": end,
+            "dates": [row.log_date for row in rows],
+            "series": {name: [getattr(row, name) for row in rows] for name in series_names},
+        }, response)
+    except Exception as e:
+        logger.error(f"Error al calcular series móviles para el usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
+
+# ----- Consulta múltiple de tendencias: POST /trends/batch ------
+@app.post(
+    "/user/trends/batch",
+    response_model=TrendsBatchOut,
+    summary="Calcula varias agregaciones (métrica, período) en una sola petición y un solo recorrido de los logs.",
+    tags=["Trends"],
+    responses={
+        200 : {"description": "Métricas devueltas exitosamente, indexadas por la clave de cada consulta."},
+        401 : {"description" : "Token inválido o expirado."},
+        400 : {"description": "Consultas con claves duplicadas."}
+    }
+)
+def get_log_trends_batch(payload: TrendsBatchInput, token : str= Depends(oauth2_scheme)):
+    user = get_current_user(token)
+    user_id = user.id
+    db = get_session(user_id)
+    try:
+
+        keys = [spec.result_key() for spec in payload.specs]
+        if len(set(keys)) != len(keys):
+            raise HTTPException(status_code=400, detail="Las claves de las consultas deben ser únicas.")
+
+        periods = [resolve_period(spec.last_days, spec.start, spec.end) for spec in payload.specs]
+        if trends_cache is not None:
+            # Todas las consultas se resuelven sobre la misma serie en caché (solo logs diarios)
+            series = user_series(db, user)
+            results = {
+                key: combine_stats(series.stats(start, end), None, spec.metric_type)
+                for key, spec, (start, end) in zip(keys, payload.specs, periods)
+            }
+            logger.info(f"Tendencias múltiples calculadas (caché) para el usuario {user_id} ({len(keys)} consultas).")
+            return respond(results)
+
+        # Agregación condicional: cada consulta agrega solo las filas de su período,
+        # p.ej. AVG(CASE WHEN log_date >= :inicio THEN steps END), y todas comparten el mismo recorrido.
+        selected_metrics = []
+        for index, (spec, (start, end)) in enumerate(zip(payload.specs, periods)):
+            in_period = period_condition(start, end)
+            selected_func = AGGREGATE_FUNCS[spec.metric_type]
+            selected_metrics.extend(
+                selected_func(case((in_period, col))).label(f"q{index}_{col.name}") for col in METRIC_COLUMNS
+            )
+
+        # Solo recorremos la ventana más amplia de todas las consultas
+        widest_start = min(start for start, _ in periods)
+        ends = [end for _, end in periods]
+        filters = [DailyLogDB.user_id == user_id, DailyLogDB.log_date >= widest_start]
+        if None not in ends:
+            filters.append(DailyLogDB.log_date <= max(ends))
+        row = db.query(*selected_metrics).filter(*filters).one()._asdict()
+
+        results = {
+            key: {col.name: row[f"q{index}_{col.name}"] for col in METRIC_COLUMNS}
+            for index, key in enumerate(keys)
+        }
+        logger.info(f"Tendencias múltiples calculadas para el usuario {user_id} ({len(keys)} consultas en un recorrido).")
+        return respond(results)
+    except Exception as e:
+        logger.error(f"Error al calcular tendencias múltiples para el usuario {user_id}: {e}")
+        raise
+    finally:
+        db.close()
+
+
+### Administración: tendencias de grupos
+# ----- Agregación por usuario de un grupo ------
+@app.post(
+    "/admin/trends/group",
+    summary="Agregación por usuario de un grupo (ids o rango de edad) con ranking opcional, en formato NDJSON.",
+    tags=["Admin"],
+    response_class=StreamingResponse,
+    responses={
+        200 : {"description": "Flujo `application/x-ndjson`: una línea `{user_id, days, metrics}` por usuario con logs en el período (con `rank` si se pide ranking)."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."},
+        422 : {"description" : "Grupo o período no válidos."}
+    }
+)
+def get_group_trends(payload: GroupTrendsInput, token : str= Depends(oauth2_scheme)):
+    admin = get_admin_user(token)
+    start_date, end_date = resolve_period(payload.last_days, payload.start, payload.end)
+
+    def lines():
+        try:
+            rows = group_trend_rows(payload, start_date, end_date)
+            if payload.rank_by is not None:
+                rows = rank_group_rows(rows, payload.rank_by, payload.order, payload.limit)
+            count = 0
+            for row in rows:
+                count += 1
+                yield json.dumps(row, default=str, separators=(",", ":")) + "\n"
+            logger.info(f"Tendencias de grupo calculadas para {admin.id}: {count} usuarios ({payload.metric_type.value} desde {start_date}).")
+        except Exception as e:
+            logger.error(f"Error al calcular tendencias de grupo para {admin.id}: {e}")
+            raise
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+### Administración: tareas programadas
+# ----- Listar tareas ------
+@app.get(
+    "/admin/jobs",
+    response_model=List[JobStatusOut],
+    summary="Lista las tareas programadas con sus métricas de ejecución.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Tareas devueltas exitosamente."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."}
+    }
+)
+async def list_jobs(token : str= Depends(oauth2_scheme)):
+    await asyncio.to_thread(get_admin_user, token)
+    return scheduler.list_jobs()
+
+# ----- Ejecutar una tarea ------
+@app.post(
+    "/admin/jobs/{name}/run",
+    response_model=JobRunOut,
+    summary="Ejecuta inmediatamente una tarea programada.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Tarea ejecutada (o ya en curso)."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."},
+        404 : {"description" : "La tarea no existe."}
+    }
+)
+async def trigger_job(name: str, token : str= Depends(oauth2_scheme)):
+    admin = await asyncio.to_thread(get_admin_user, token)
+    job = scheduler.get_job(name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No existe la tarea '{name}'.")
+    logger.info(f"Ejecución manual de la tarea '{name}' solicitada por {admin.id}.")
+    executed = await scheduler.run_job(name, force=True)
+    return {"executed": executed, "job": job.as_dict()}
+
+# ----- Snapshot columnar para análisis ------
+@app.post(
+    "/admin/snapshots",
+    summary="Genera un snapshot columnar (.npy con memory-map y Parquet opcional) de los logs, incremental respecto al último.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Snapshot generado. Se devuelve su manifiesto."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."},
+        503 : {"description" : "numpy no está instalado."}
+    }
+)
+def create_snapshot(
+    full: bool = Query(False, description="Relee todos los logs en lugar de partir del último snapshot."),
+    token : str= Depends(oauth2_scheme)
+):
+    admin = get_admin_user(token)
+    try:
+        manifest = export_snapshot(full=full)
+        logger.info(f"Snapshot {manifest['name']} generado a petición de {admin.id}.")
+        return manifest
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error al generar el snapshot: {e}")
+        raise
+
+# ----- Métricas del control de admisión ------
+@app.get(
+    "/admin/rate-limits",
+    summary="Límites configurados y métricas del control de admisión por clase de rutas.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Métricas devueltas exitosamente."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."}
+    }
+)
+def get_rate_limit_metrics(token : str= Depends(oauth2_scheme)):
+    get_admin_user(token)
+    return {"enabled": RATE_LIMIT_ENABLED, **rate_limiter.metrics()}
 
+# ----- Métricas de la caché de series ------
+@app.get(
+    "/admin/trends-cache",
+    summary="Ocupación y métricas (aciertos, fallos, parches, desalojos) de la caché columnar de series.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Métricas devueltas exitosamente."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."}
+    }
+)
+def get_trends_cache_metrics(token : str= Depends(oauth2_scheme)):
+    get_admin_user(token)
+    if trends_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **trends_cache.metrics()}
+
+# ----- Informe de arranque ------
+@app.get(
+    "/admin/startup",
+    summary="Tiempos del arranque en frío del proceso (importaciones, aplicación lista y primera petición).",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Informe de arranque devuelto exitosamente."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."}
+    }
+)
+def get_startup_report(token : str= Depends(oauth2_scheme)):
+    get_admin_user(token)
+    return startup_report.as_dict()
+
+# ----- Distribución de costes de hash ------
+@app.get(
+    "/admin/password-hashes",
+    response_model=HashCostStatsOut,
+    summary="Distribución de los hashes de contraseña por coste de bcrypt y progreso de la migración.",
+    tags=["Admin"],
+    responses={
+        200 : {"description": "Distribución devuelta exitosamente."},
+        401 : {"description" : "Token inválido o expirado."},
+        403 : {"description" : "El usuario no es administrador."}
+    }
+)
+def get_password_hash_stats(token : str= Depends(oauth2_scheme)):
+    get_admin_user(token)
+    try:
+        distribution = password_hash_costs()
+        total = sum(distribution.values())
+        return {
+            "configured_rounds": BCRYPT_ROUNDS,
+            "distribution": distribution,
+            "migrated_ratio": round(distribution.get(str(BCRYPT_ROUNDS), 0) / total, 4) if total else 1.0,
+            "rehashed": password_rehash_metrics["rehashed"],
+            "rehash_failures": password_rehash_metrics["failed"],
+        }
+    except Exception as e:
+        logger.error(f"Error al calcular la distribución de hashes: {e}")
+        raise
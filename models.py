@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Date, Float, ForeignKey
+from sqlalchemy import Column, String, Integer, Date, DateTime, Float, ForeignKey, Text, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base  # Importamos Base (definida en database.py) para que los modelos hereden de ella
 
@@ -9,14 +9,18 @@ class UserDB(Base):
     age = Column(Integer, nullable =True)
     email = Column(String, unique = True, index= True)
     password_hash = Column(String, nullable=False)
+    # Versión de los datos del usuario: se incrementa con cada escritura (perfil o logs) y sirve para los ETag
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, nullable=True)
     # back_populates, on delete cascade
-    logs = relationship("DailyLogDB", back_populates="user", cascade="all, delete-orphan" )
-    # mejora --> timestamps: created_at, updated_at.
+    # passive_deletes: el borrado de los logs lo hace la BD (ON DELETE CASCADE) sin cargarlos en memoria
+    logs = relationship("DailyLogDB", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    # mejora --> timestamps: created_at.
 
 class DailyLogDB(Base):
     __tablename__='logs'
     # Clave primaria compuesta
-    user_id = Column(String,ForeignKey("users.id"), primary_key=True )
+    user_id = Column(String,ForeignKey("users.id", ondelete="CASCADE"), primary_key=True )
     log_date=Column(Date, primary_key=True ,index=True)
     # Métricas 
     steps = Column(Integer, nullable = True)
@@ -27,3 +31,92 @@ class DailyLogDB(Base):
     mood = Column(Integer, nullable = True)
     # back_populates
     user = relationship("UserDB", back_populates="logs")
+
+# Columnas de métricas de los logs diarios (mismo orden que LogTrendsOut)
+METRIC_COLUMNS = [
+    DailyLogDB.steps,
+    DailyLogDB.exercise_minutes,
+    DailyLogDB.sleep_hours,
+    DailyLogDB.water_liters,
+    DailyLogDB.diet_score,
+    DailyLogDB.mood,
+]
+
+class MonthlyLogSummaryDB(Base):
+    """Resumen mensual de los logs diarios compactados (más antiguos que el horizonte de retención).
+    Por cada métrica guarda número de valores, suma, mínimo, máximo y suma de cuadrados."""
+    __tablename__ = "logs_monthly"
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # Primer día del mes resumido
+    month = Column(Date, primary_key=True, index=True)
+    days = Column(Integer, nullable=False, default=0)
+    # Pasos
+    steps_count = Column(Integer, nullable=False, default=0)
+    steps_sum = Column(Float, nullable=True)
+    steps_min = Column(Float, nullable=True)
+    steps_max = Column(Float, nullable=True)
+    steps_sumsq = Column(Float, nullable=True)
+    # Minutos de ejercicio
+    exercise_minutes_count = Column(Integer, nullable=False, default=0)
+    exercise_minutes_sum = Column(Float, nullable=True)
+    exercise_minutes_min = Column(Float, nullable=True)
+    exercise_minutes_max = Column(Float, nullable=True)
+    exercise_minutes_sumsq = Column(Float, nullable=True)
+    # Horas de sueño
+    sleep_hours_count = Column(Integer, nullable=False, default=0)
+    sleep_hours_sum = Column(Float, nullable=True)
+    sleep_hours_min = Column(Float, nullable=True)
+    sleep_hours_max = Column(Float, nullable=True)
+    sleep_hours_sumsq = Column(Float, nullable=True)
+    # Litros de agua
+    water_liters_count = Column(Integer, nullable=False, default=0)
+    water_liters_sum = Column(Float, nullable=True)
+    water_liters_min = Column(Float, nullable=True)
+    water_liters_max = Column(Float, nullable=True)
+    water_liters_sumsq = Column(Float, nullable=True)
+    # Puntuación de la dieta
+    diet_score_count = Column(Integer, nullable=False, default=0)
+    diet_score_sum = Column(Float, nullable=True)
+    diet_score_min = Column(Float, nullable=True)
+    diet_score_max = Column(Float, nullable=True)
+    diet_score_sumsq = Column(Float, nullable=True)
+    # Estado de ánimo
+    mood_count = Column(Integer, nullable=False, default=0)
+    mood_sum = Column(Float, nullable=True)
+    mood_min = Column(Float, nullable=True)
+    mood_max = Column(Float, nullable=True)
+    mood_sumsq = Column(Float, nullable=True)
+
+class JobLockDB(Base):
+    """Bloqueo de las tareas programadas, compartido por todos los workers (solo en la base de datos principal)."""
+    __tablename__ = "job_locks"
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=False)
+
+class RefreshTokenDB(Base):
+    """Refresh tokens emitidos en el login. Solo se guarda el hash SHA-256 del token (nunca el token).
+    Los tokens de una misma cadena de rotación comparten `family_id`."""
+    __tablename__ = "refresh_tokens"
+    token_hash = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    family_id = Column(String, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=True)
+    # Hash del token que lo sustituyó al rotar (None si se revocó sin rotación)
+    replaced_by = Column(String, nullable=True)
+
+class IdempotencyKeyDB(Base):
+    """Respuestas guardadas por cabecera Idempotency-Key. `scope` es el user_id (en el registro, el de la
+    cuenta que se crea). Mientras la petición original está en curso `status_code` es None y `expires_at` hace
+    de reserva; al terminar se guarda la respuesta y caduca a las IDEMPOTENCY_TTL_HOURS horas."""
+    __tablename__ = "idempotency_keys"
+    scope = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    headers = Column(Text, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
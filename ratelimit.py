@@ -0,0 +1,261 @@
+import os, abc, math, time, asyncio, threading, logging
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional, Tuple
+from fastapi.responses import JSONResponse
+
+from security import decode_access_token
+from idempotency import read_body, replay_receive
+
+logger = logging.getLogger("main.ratelimit")
+
+
+# ------ Almacén de buckets ------
+class RateLimitStore(abc.ABC):
+    """Interfaz del almacén de token buckets. La implementación en memoria sirve para un solo proceso;
+    un almacén compartido (p.ej. Redis) solo tiene que implementar `take` para usarse entre workers."""
+
+    @abc.abstractmethod
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1) -> float:
+        """Consume `cost` fichas del bucket `key`. Devuelve 0 si se admite la petición o, si no,
+        los segundos que faltan para que haya fichas suficientes."""
+
+    def __len__(self) -> int:
+        return 0
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Token buckets en un diccionario ordenado por último acceso. Cada operación es O(1) amortizado:
+    los buckets que ya se habrían rellenado del todo se eliminan desde el principio del diccionario,
+    porque un bucket lleno equivale a uno que no existe."""
+
+    def __init__(self):
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [fichas, última actualización, expiración]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            if tokens >= cost:
+                tokens -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - tokens) / rate
+            self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+            self._expire(now)
+        return retry_after
+
+    def _expire(self, now: float, max_checks: int = 2):
+        for _ in range(max_checks):
+            if not self._buckets:
+                return
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[2] > now:
+                return
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# ------ Límite de concurrencia ------
+class ConcurrencyLimit:
+    """Número máximo de peticiones simultáneas de una clase de rutas. Las que no caben esperan en
+    cola (FIFO) hasta `timeout` segundos; al liberar un hueco se entrega directamente al primero."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+        if timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # Si el hueco ya se había cedido a este cliente no se usa: se devuelve para no perderlo
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        # El hueco pasa al primer cliente en espera sin bajar el contador
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
+
+
+# ------ Límites por clase de rutas ------
+class RouteLimits:
+    """Límites de una clase de rutas. `*_rate` en peticiones por segundo y `*_burst` como tamaño del
+    bucket; un rate de 0 desactiva ese límite. Cada valor se puede sobrescribir con la variable de
+    entorno RATE_LIMIT_<CLASE>_<CAMPO> (p.ej. RATE_LIMIT_AUTH_HASH_MAX_CONCURRENCY=4)."""
+    FIELDS = ("ip_rate", "ip_burst", "user_rate", "user_burst", "max_concurrency", "queue_timeout")
+
+    def __init__(self, name: str, ip_rate: float = 0, ip_burst: float = 0, user_rate: float = 0,
+                 user_burst: float = 0, max_concurrency: int = 0, queue_timeout: float = 0):
+        self.name = name
+        env_prefix = "RATE_LIMIT_" + name.upper().replace("-", "_") + "_"
+        values = dict(ip_rate=ip_rate, ip_burst=ip_burst, user_rate=user_rate, user_burst=user_burst,
+                      max_concurrency=max_concurrency, queue_timeout=queue_timeout)
+        for field in self.FIELDS:
+            cast = int if field == "max_concurrency" else float
+            setattr(self, field, cast(os.getenv(env_prefix + field.upper(), values[field])))
+        self.concurrency = ConcurrencyLimit(self.max_concurrency) if self.max_concurrency > 0 else None
+        self.counters = {"requests": 0, "limited_ip": 0, "limited_user": 0, "rejected_concurrency": 0, "queued": 0}
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "limits": {field: getattr(self, field) for field in self.FIELDS},
+            **self.counters,
+            "in_flight": self.concurrency.in_flight if self.concurrency else None,
+            "waiting": self.concurrency.queued if self.concurrency else None,
+            "peak_in_flight": self.concurrency.peak if self.concurrency else None,
+        }
+
+
+class RateLimiter:
+    """Control de admisión: token buckets por IP y por usuario y límite de concurrencia por clase de rutas.
+
+    En las rutas de `body_subjects` (sin token, p.ej. el login) el bucket por IP se reparte además por la
+    cuenta que devuelve `body_subjects[ruta](cuerpo)`: detrás de un proxy sin TRUST_PROXY_HEADERS todos los
+    clientes comparten IP y un único bucket limitaría el login de todos a la vez."""
+
+    def __init__(self, store: RateLimitStore, route_classes: Dict[str, RouteLimits],
+                 routes: Dict[Tuple[str, str], str], trust_proxy_headers: bool = False,
+                 body_subjects: Optional[Dict[str, Callable[[bytes], Optional[str]]]] = None):
+        self.store = store
+        self.route_classes = route_classes
+        self._routes = routes                          # (método, ruta) -> clase
+        self.trust_proxy_headers = trust_proxy_headers
+        self.body_subjects = body_subjects or {}       # ruta -> cuenta a partir del cuerpo
+
+    def classify(self, method: str, path: str) -> Optional[RouteLimits]:
+        name = self._routes.get((method, path))
+        return self.route_classes[name] if name else None
+
+    def client_ip(self, scope) -> str:
+        if self.trust_proxy_headers:
+            for header, value in scope["headers"]:
+                if header == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    def user_id(scope) -> Optional[str]:
+        """Usuario del Bearer token. Solo se confía en tokens con firma válida, para que nadie pueda
+        agotar el bucket de otro usuario."""
+        for header, value in scope["headers"]:
+            if header == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() != "bearer":
+                    return None
+                try:
+                    return decode_access_token(token).get("sub")
+                except Exception:
+                    return None
+        return None
+
+    def body_subject(self, scope, body: Optional[bytes]) -> Optional[str]:
+        subject_of = self.body_subjects.get(scope["path"])
+        return subject_of(body) if subject_of is not None and body is not None else None
+
+    def check_rate(self, limits: RouteLimits, scope, body: Optional[bytes] = None) -> Optional[Tuple[str, float]]:
+        """Devuelve (motivo, segundos de espera) si la petición supera algún límite de frecuencia."""
+        if limits.ip_rate > 0:
+            ip_key = f"{limits.name}:ip:{self.client_ip(scope)}"
+            subject = self.body_subject(scope, body)
+            if subject is not None:
+                ip_key += f":{subject}"
+            retry_after = self.store.take(ip_key, limits.ip_rate, limits.ip_burst)
+            if retry_after:
+                return "limited_ip", retry_after
+        if limits.user_rate > 0:
+            user_id = self.user_id(scope)
+            if user_id is not None:
+                retry_after = self.store.take(f"{limits.name}:user:{user_id}", limits.user_rate, limits.user_burst)
+                if retry_after:
+                    return "limited_user", retry_after
+        return None
+
+    def metrics(self) -> dict:
+        return {
+            "buckets": len(self.store),
+            "route_classes": [limits.as_dict() for limits in self.route_classes.values()],
+        }
+
+
+def too_many_requests(detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429, content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI que aplica el RateLimiter antes de ejecutar el endpoint."""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limits = self.limiter.classify(scope["method"], scope["path"])
+        if limits is None:
+            return await self.app(scope, receive, send)
+        limits.counters["requests"] += 1
+
+        body = None
+        if scope["path"] in self.limiter.body_subjects:
+            body = await read_body(receive)
+            receive = replay_receive(body, receive)
+        rejected = self.limiter.check_rate(limits, scope, body)
+        if rejected is not None:
+            reason, retry_after = rejected
+            limits.counters[reason] += 1
+            logger.warning(f"Petición limitada ({limits.name}, {reason}) desde {self.limiter.client_ip(scope)}.")
+            return await too_many_requests("Demasiadas peticiones. Inténtalo más tarde.", retry_after)(scope, receive, send)
+
+        concurrency = limits.concurrency
+        if concurrency is None:
+            return await self.app(scope, receive, send)
+        if concurrency.in_flight >= concurrency.limit:
+            limits.counters["queued"] += 1
+        if not await concurrency.acquire(limits.queue_timeout):
+            limits.counters["rejected_concurrency"] += 1
+            logger.warning(f"Capacidad agotada para '{limits.name}' ({concurrency.limit} peticiones simultáneas).")
+            return await too_many_requests("El servidor está ocupado. Inténtalo más tarde.", 1)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            concurrency.release()
@@ -0,0 +1,30 @@
+import os, json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+# orjson es opcional: si no está instalado se usa el codificador estándar
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# ------ Modo de serialización rápida ------
+# Con FAST_RESPONSES=1 los endpoints construyen la respuesta directamente a partir de las filas
+# y la devuelven con FastJSONResponse, sin volver a validarla con el response_model.
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "0") == "1"
+
+
+def _default(value: Any):
+    """Codificador de respaldo para json.dumps (fechas)."""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """Respuesta JSON serializada con orjson (o con json compacto si orjson no está disponible)."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
@@ -0,0 +1,268 @@
+import os, time, random, socket, asyncio, logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.exc import IntegrityError
+
+from models import JobLockDB
+
+logger = logging.getLogger("main.scheduler")
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CronSchedule:
+    """Expresión cron de 5 campos (minuto hora día mes día_semana) con `*`, `*/n`, `a-b` y listas `a,b`.
+    El día de la semana va de 0 (domingo) a 6. Las horas se interpretan en UTC. Como en cron, si el día
+    del mes y el día de la semana están restringidos (no empiezan por `*`) basta con que se cumpla uno:
+    `0 3 1 * 1` se ejecuta el día 1 de cada mes y todos los lunes."""
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expresión cron no válida: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self._RANGES)
+        )
+        self._days_or_weekdays = not fields[2].startswith("*") and not fields[4].startswith("*")
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/")
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = map(int, part.split("-"))
+            else:
+                start = end = int(part)
+            if start < low or end > high or step < 1:
+                raise ValueError(f"Campo cron fuera de rango: '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Siguiente instante (con precisión de minutos) posterior a `moment` que cumple la expresión."""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"La expresión cron '{self.expression}' no tiene ejecuciones próximas.")
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok, weekday_ok = moment.day in self.days, (moment.isoweekday() % 7) in self.weekdays
+        return (day_ok or weekday_ok) if self._days_or_weekdays else (day_ok and weekday_ok)
+
+
+class Job:
+    """Tarea programada con sus métricas de ejecución."""
+
+    def __init__(self, name: str, func: Callable, interval: Optional[float] = None, cron: Optional[str] = None,
+                 jitter: float = 0, lock_ttl: float = 600, run_on_start: bool = False):
+        if (interval is None) == (cron is None):
+            raise ValueError("Cada tarea necesita 'interval' o 'cron' (solo uno de ellos).")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.lock_ttl = lock_ttl
+        self.run_on_start = run_on_start
+        self.lock = asyncio.Lock()
+        # Métricas
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_duration: Optional[float] = None
+        self.last_started_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.next_run_at: Optional[datetime] = None
+
+    def next_run(self, now: datetime) -> datetime:
+        if self.cron is not None:
+            moment = self.cron.next_after(now)
+        else:
+            moment = now + timedelta(seconds=self.interval)
+        return moment + timedelta(seconds=random.uniform(0, self.jitter))
+
+    def period(self, now: datetime) -> float:
+        """Duración aproximada (segundos) entre dos ejecuciones programadas."""
+        if self.cron is not None:
+            first = self.cron.next_after(now)
+            return (self.cron.next_after(first) - first).total_seconds()
+        return self.interval
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "schedule": self.cron.expression if self.cron else f"every {self.interval:g}s",
+            "jitter_seconds": self.jitter,
+            "running": self.lock.locked(),
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started_at": self.last_started_at,
+            "last_duration_ms": round(self.last_duration * 1000, 2) if self.last_duration is not None else None,
+            "avg_duration_ms": round(self.total_duration / self.runs * 1000, 2) if self.runs else None,
+            "max_duration_ms": round(self.max_duration * 1000, 2),
+            "last_error": self.last_error,
+            "next_run_at": self.next_run_at,
+        }
+
+
+class Scheduler:
+    """Planificador asyncio para tareas de mantenimiento fuera del camino de las peticiones.
+
+    Las funciones de las tareas son síncronas y se ejecutan en un hilo. Para que varios workers no
+    repitan el mismo trabajo, cada ejecución programada reserva la tarea en la tabla `job_locks`
+    durante su período: el resto de workers la omiten hasta que vence la reserva.
+    """
+
+    def __init__(self, session_factory: Optional[Callable] = None, shutdown_timeout: float = 30):
+        self._session_factory = session_factory
+        self._shutdown_timeout = shutdown_timeout
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping: Optional[asyncio.Event] = None
+
+    # ------ Registro y consulta ------
+    def add_job(self, name: str, func: Callable, **options) -> Job:
+        if name in self._jobs:
+            raise ValueError(f"La tarea '{name}' ya está registrada.")
+        job = Job(name, func, **options)
+        self._jobs[name] = job
+        return job
+
+    def get_job(self, name: str) -> Optional[Job]:
+        return self._jobs.get(name)
+
+    def list_jobs(self) -> List[dict]:
+        return [job.as_dict() for job in self._jobs.values()]
+
+    # ------ Ciclo de vida ------
+    async def start(self):
+        self._stopping = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._loop(job), name=f"job:{job.name}") for job in self._jobs.values()]
+        logger.info(f"Planificador iniciado con {len(self._tasks)} tareas.")
+
+    async def stop(self):
+        """Deja de programar ejecuciones, espera a las que estén en curso y cancela el resto."""
+        if self._stopping is None:
+            return
+        self._stopping.set()
+        if self._tasks:
+            done, pending = await asyncio.wait(self._tasks, timeout=self._shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        logger.info("Planificador detenido.")
+
+    async def _loop(self, job: Job):
+        if job.run_on_start:
+            await self.run_job(job.name, scheduled=True)
+        while not self._stopping.is_set():
+            job.next_run_at = job.next_run(utcnow())
+            delay = max((job.next_run_at - utcnow()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+                return                      # Parada solicitada
+            except asyncio.TimeoutError:
+                pass
+            await self.run_job(job.name, scheduled=True)
+
+    # ------ Ejecución ------
+    async def run_job(self, name: str, scheduled: bool = False, force: bool = False) -> bool:
+        """Ejecuta la tarea si no está ya en curso. Con `force` se ignora la reserva de otros workers
+        (ejecución manual). Devuelve False si se omite."""
+        job = self._jobs[name]
+        if job.lock.locked():
+            job.skipped += 1
+            return False
+        async with job.lock:
+            acquired = False if force else await asyncio.to_thread(self._acquire, name, job.lock_ttl)
+            if not force and not acquired:
+                job.skipped += 1
+                logger.info(f"Tarea '{name}' omitida: reservada por otro worker.")
+                return False
+            job.last_started_at = utcnow()
+            started = time.perf_counter()
+            failed = False
+            try:
+                await asyncio.to_thread(job.func)
+                job.last_error = None
+            except Exception as e:
+                failed = True
+                job.failures += 1
+                job.last_error = str(e)
+                logger.error(f"Error en la tarea programada '{name}': {e}")
+            finally:
+                duration = time.perf_counter() - started
+                job.runs += 1
+                job.last_duration = duration
+                job.total_duration += duration
+                job.max_duration = max(job.max_duration, duration)
+                if acquired:
+                    # Las ejecuciones programadas con éxito mantienen la reserva casi hasta el siguiente
+                    # período, para que otros workers no repitan el trabajo
+                    until = None
+                    if scheduled and not failed:
+                        until = job.last_started_at + timedelta(seconds=job.period(utcnow()) * 0.9)
+                    await asyncio.to_thread(self._release, name, until)
+            logger.info(f"Tarea '{name}' completada en {duration * 1000:.1f} ms.")
+            return True
+
+    def _acquire(self, name: str, lease_seconds: float) -> bool:
+        if self._session_factory is None:
+            return True
+        db = self._session_factory()
+        try:
+            now = utcnow()
+            until = now + timedelta(seconds=lease_seconds)
+            updated = db.query(JobLockDB).filter(
+                JobLockDB.name == name,
+                JobLockDB.locked_until < now
+            ).update({JobLockDB.owner: self._owner, JobLockDB.locked_until: until}, synchronize_session=False)
+            if not updated:
+                if db.get(JobLockDB, name) is not None:
+                    return False
+                db.add(JobLockDB(name=name, owner=self._owner, locked_until=until))
+            db.commit()
+            return True
+        except IntegrityError:
+            # Otro worker ha creado la reserva a la vez
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def _release(self, name: str, until: Optional[datetime] = None):
+        """Libera la reserva (o la mantiene hasta `until`)."""
+        if self._session_factory is None:
+            return
+        db = self._session_factory()
+        try:
+            db.query(JobLockDB).filter(JobLockDB.name == name, JobLockDB.owner == self._owner).update(
+                {JobLockDB.locked_until: max(until or utcnow(), utcnow())}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
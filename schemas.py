@@ -2,12 +2,7 @@
 from pydantic import BaseModel, Field, field_validator, model_validator, EmailStr # <-- ¡AÑADIDO BaseModel y EmailStr!
 from typing import Optional, List, Dict
 # 2. Tipos de datos de Python (date, timedelta)
-from datetime import date 
-# 3. SQLAlchemy (Tipos de datos para el ORM si los necesitas en este archivo)
-from sqlalchemy import Column, String, Integer, Float, Date, ForeignKey, UniqueConstraint, Index
-from sqlalchemy.orm import relationship
-# 4. Importación de la Base de SQLAlchemy desde el módulo principal
-from database import Base
+from datetime import date, datetime
 from enum import Enum
 
 # ------ Pydantic model ------
@@ -33,6 +28,18 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class TokenOut(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    refresh_token: str = Field(..., description="Token opaco para obtener nuevos access tokens en /auth/refresh.")
+    expires_in: int = Field(..., description="Segundos de validez del access token.")
+
+class RefreshTokenInput(BaseModel):
+    refresh_token: str = Field(..., min_length=1)
+
+class RevokedSessionsOut(BaseModel):
+    revoked: int = Field(..., description="Número de refresh tokens revocados.")
+
 class UserOut(BaseModel):
     id: str
     name: str
@@ -72,7 +79,16 @@ class DailyLogInput(BaseModel):
             raise ValueError("El numero de horas totales (sueño y deporte) no puede ser mayor de 24h.")
         return self 
 
-class DailyLogOutput (DailyLogInput):
+class DailyLogOutput (BaseModel):
+    """Log diario devuelto por la API. No hereda de DailyLogInput para no repetir las validaciones de entrada
+    sobre datos que ya están en la base de datos."""
+    log_date: date
+    steps: Optional[int] = None
+    exercise_minutes: Optional[int] = None
+    sleep_hours: Optional[float] = None
+    water_liters: Optional[float] = None
+    diet_score: Optional[int] = None
+    mood: Optional[int] = None
     user_id: str
     
     class Config:
@@ -115,3 +131,137 @@ class LogTrendsOut(BaseModel):
     
 # Alias para el endpoint dinámico (GET /user/trends)
 MetricsSummary = Dict[str, Optional[float]]
+
+
+class LogMetric(str, Enum):
+    """Métricas registrables en los logs diarios."""
+    STEPS = "steps"
+    EXERCISE_MINUTES = "exercise_minutes"
+    SLEEP_HOURS = "sleep_hours"
+    WATER_LITERS = "water_liters"
+    DIET_SCORE = "diet_score"
+    MOOD = "mood"
+
+# Modelo para las series de medias móviles (GET /user/trends/rolling)
+class RollingSeriesOut(BaseModel):
+    """Series móviles en formato columnar: una lista de fechas y una lista de valores por serie.
+    Las claves de `series` siguen el patrón `{agregación}_{métrica}_{ventana}d`, p.ej. `avg_steps_7d`."""
+    start: date
+    end: date
+    dates: List[date]
+    series: Dict[str, List[Optional[float]]]
+
+# Modelos para la consulta múltiple de tendencias (POST /user/trends/batch)
+class TrendSpec(BaseModel):
+    """Consulta individual: una agregación sobre los últimos X días o sobre un rango de fechas."""
+    key: Optional[str] = Field(None, max_length=100, description="Clave del resultado. Por defecto `{agregación}_{días}d` o `{agregación}_{inicio}_{fin}`.")
+    metric_type: MetricType = Field(..., description="Agregación a calcular.")
+    last_days: Optional[int] = Field(None, ge=0, description="Número de días hacia atrás desde hoy.")
+    start: Optional[date] = Field(None, description="Fecha inicial del rango (incluida).")
+    end: Optional[date] = Field(None, description="Fecha final del rango (incluida). Por defecto, sin límite.")
+
+    @model_validator(mode="after")
+    def validate_period(self):
+        if self.last_days is None and self.start is None:
+            raise ValueError("Debe indicarse 'last_days' o un rango con 'start'.")
+        if self.last_days is not None and (self.start is not None or self.end is not None):
+            raise ValueError("'last_days' no puede combinarse con 'start'/'end'.")
+        if self.start is not None and self.end is not None and self.start > self.end:
+            raise ValueError("La fecha inicial debe ser anterior o igual a la final.")
+        return self
+
+    def result_key(self) -> str:
+        if self.key:
+            return self.key
+        if self.last_days is not None:
+            return f"{self.metric_type.value}_{self.last_days}d"
+        return f"{self.metric_type.value}_{self.start}_{self.end or 'today'}"
+
+class TrendsBatchInput(BaseModel):
+    """Lista de consultas de tendencias que se resuelven con un único recorrido de los logs."""
+    specs: List[TrendSpec] = Field(..., min_length=1, max_length=50)
+
+# Resultado de la consulta múltiple: clave de la consulta -> métricas
+TrendsBatchOut = Dict[str, MetricsSummary]
+
+
+class ComparePeriod(str, Enum):
+    """Período de referencia con el que comparar las tendencias."""
+    PREVIOUS_PERIOD = "previous_period"
+    PREVIOUS_YEAR = "previous_year"
+
+class PeriodSummary(BaseModel):
+    """Métricas agregadas de un período concreto."""
+    start: date
+    end: date
+    metrics: MetricsSummary
+
+class TrendsComparisonOut(BaseModel):
+    """Comparación de un período con su período de referencia, con diferencias absolutas y porcentuales."""
+    metric_type: MetricType
+    current: PeriodSummary
+    previous: PeriodSummary
+    delta: MetricsSummary = Field(..., description="Diferencia absoluta (actual - anterior).")
+    delta_pct: MetricsSummary = Field(..., description="Diferencia porcentual respecto al período anterior.")
+
+
+# Modelos para las tendencias de un grupo de usuarios (POST /admin/trends/group)
+class RankOrder(str, Enum):
+    """Sentido del ranking: los valores más altos o los más bajos."""
+    TOP = "top"
+    BOTTOM = "bottom"
+
+class GroupTrendsInput(BaseModel):
+    """Agregación por usuario de un grupo, indicado por sus ids y/o por un rango de edad."""
+    user_ids: Optional[List[str]] = Field(None, min_length=1, max_length=10000, description="Usuarios del grupo.")
+    min_age: Optional[int] = Field(None, ge=0, description="Edad mínima (incluida).")
+    max_age: Optional[int] = Field(None, ge=0, description="Edad máxima (incluida).")
+    metric_type: MetricType = Field(..., description="Agregación a calcular.")
+    last_days: Optional[int] = Field(None, ge=0, description="Número de días hacia atrás desde hoy.")
+    start: Optional[date] = Field(None, description="Fecha inicial del rango (incluida).")
+    end: Optional[date] = Field(None, description="Fecha final del rango (incluida). Por defecto, sin límite.")
+    rank_by: Optional[LogMetric] = Field(None, description="Métrica por la que ordenar. Sin ella se devuelven todos los usuarios.")
+    order: RankOrder = Field(RankOrder.TOP, description="Con `rank_by`: los valores más altos (`top`) o los más bajos (`bottom`).")
+    limit: int = Field(10, ge=1, le=1000, description="Con `rank_by`: número de usuarios del ranking.")
+
+    @model_validator(mode="after")
+    def validate_group(self):
+        if self.user_ids is None and self.min_age is None and self.max_age is None:
+            raise ValueError("Debe indicarse 'user_ids' o un rango de edad ('min_age'/'max_age').")
+        if self.min_age is not None and self.max_age is not None and self.min_age > self.max_age:
+            raise ValueError("La edad mínima debe ser menor o igual que la máxima.")
+        if self.last_days is None and self.start is None:
+            raise ValueError("Debe indicarse 'last_days' o un rango con 'start'.")
+        if self.last_days is not None and (self.start is not None or self.end is not None):
+            raise ValueError("'last_days' no puede combinarse con 'start'/'end'.")
+        if self.start is not None and self.end is not None and self.start > self.end:
+            raise ValueError("La fecha inicial debe ser anterior o igual a la final.")
+        return self
+
+
+# Estado y métricas de una tarea programada (GET /admin/jobs)
+class JobStatusOut(BaseModel):
+    name: str
+    schedule: str
+    jitter_seconds: float
+    running: bool
+    runs: int
+    failures: int
+    skipped: int
+    last_started_at: Optional[datetime]
+    last_duration_ms: Optional[float]
+    avg_duration_ms: Optional[float]
+    max_duration_ms: float
+    last_error: Optional[str]
+    next_run_at: Optional[datetime]
+
+class JobRunOut(BaseModel):
+    executed: bool = Field(..., description="False si la tarea ya estaba en ejecución.")
+    job: JobStatusOut
+
+class HashCostStatsOut(BaseModel):
+    configured_rounds: int = Field(..., description="Coste de bcrypt configurado (BCRYPT_ROUNDS).")
+    distribution: Dict[str, int] = Field(..., description="Número de usuarios por coste de su hash.")
+    migrated_ratio: float = Field(..., description="Fracción de usuarios cuyo hash ya usa el coste configurado.")
+    rehashed: int = Field(..., description="Hashes actualizados en el login desde el arranque de este proceso.")
+    rehash_failures: int = Field(..., description="Actualizaciones de hash fallidas desde el arranque.")
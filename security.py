@@ -1,21 +1,28 @@
-import os, jwt
-from dotenv import load_dotenv
-import hashlib
-from passlib.context import CryptContext     # metodología de encriptación perimite actualizar sin romper contraseñas anteriores
+import os
+import hashlib, secrets, time, statistics
+from functools import lru_cache
+from typing import Optional, Dict, Tuple
 from datetime import datetime, timedelta, timezone
-from jwt import ExpiredSignatureError, InvalidTokenError
+# jwt y passlib se importan de forma perezosa para acelerar el arranque en frío
 
 
 
 # ------ Cargamos variables de entorno ------
-load_dotenv() 
+# El .env se busca junto a este módulo y después desde el cwd, arranque la app desde donde arranque
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+load_dotenv(find_dotenv(usecwd=True))
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
 
 # ------ Función para crear token JWT ------
-def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
+def create_access_token(data: dict, expires_minutes: Optional[int] = None) -> str:
     """Genera un token JWT con expiración."""
+    import jwt
+    if expires_minutes is None:
+        expires_minutes = ACCESS_TOKEN_EXPIRE_MINUTES
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=expires_minutes)
     to_encode.update({"exp": expire})
@@ -24,6 +31,8 @@ def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_M
 # ------ Función para verificar y decodificar el token JWT ------
 def decode_access_token(token: str) -> dict:
     """Verifica y decodifica un JWT, lanzando excepción si está expirado o es inválido."""
+    import jwt
+    from jwt import ExpiredSignatureError, InvalidTokenError
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -33,8 +42,36 @@ def decode_access_token(token: str) -> dict:
         raise InvalidTokenError("Token inválido o manipulado")
     
 
+# ------ Refresh tokens opacos ------
+def create_refresh_token(user_id: str) -> str:
+    """Genera un refresh token opaco "<user_id>.<secreto aleatorio>". El prefijo permite localizar
+    el shard del usuario sin consultar ninguna tabla; la seguridad la aporta el secreto de 256 bits."""
+    return f"{user_id}.{secrets.token_urlsafe(32)}"
+
+def hash_refresh_token(token: str) -> str:
+    """Hash con el que se guarda el token. SHA-256 basta: el token es aleatorio y no se puede adivinar."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def refresh_token_user_id(token: str) -> Optional[str]:
+    """Usuario al que pertenece un refresh token (o None si el formato no es válido)."""
+    user_id, separator, secret = token.partition(".")
+    return user_id if separator and user_id and secret else None
+
+
 # ------ Configuración del contexto de contraseñas ------
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Coste de bcrypt (log2 de las iteraciones). Se calibra para el hardware con `python security.py --calibrate`
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """Contexto de passlib, creado en el primer uso (la importación de passlib es costosa)."""
+    from passlib.context import CryptContext     # metodología de encriptación perimite actualizar sin romper contraseñas anteriores
+    # min_rounds = max_rounds: cualquier hash con otro coste se marca para actualizar (needs_update)
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
+
 # Límite de bytes para bcrypt
 BCRYPT_MAX_LENGTH = 72
 
@@ -45,16 +82,61 @@ def hash_password(raw_password: str) -> str:
     truncated_password = raw_password[:BCRYPT_MAX_LENGTH]
     # Convierte a bytes (bcrypt opera en bytes)
     password_bytes = truncated_password.encode("utf-8")
-    return pwd_context.hash(password_bytes)
+    return get_pwd_context().hash(password_bytes)
 
 def verify_password(raw_password: str, hashed_password: str) -> bool:
     """Verifica si la contraseña coincide con el hash almacenado."""
     truncated_password = raw_password[:BCRYPT_MAX_LENGTH]
     password_bytes = truncated_password.encode("utf-8")
-    return pwd_context.verify(password_bytes, hashed_password)
+    return get_pwd_context().verify(password_bytes, hashed_password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Indica si el hash se generó con un coste distinto de BCRYPT_ROUNDS (o con un esquema obsoleto)."""
+    return get_pwd_context().needs_update(hashed_password)
+
+def hash_cost(hashed_password: str) -> Optional[int]:
+    """Coste de un hash bcrypt ("$2b$12$..." -> 12), o None si no es un hash bcrypt."""
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+# ------ Calibración del coste de bcrypt ------
+def calibrate_bcrypt_rounds(target_ms: float = 100, min_rounds: int = 10, max_rounds: int = 16, samples: int = 3) -> Tuple[int, Dict[int, float]]:
+    """Mide el tiempo de hash de cada coste en este equipo y devuelve el mayor coste cuya mediana no
+    supera `target_ms` (nunca menos de `min_rounds`), junto con las mediciones en ms."""
+    from passlib.hash import bcrypt
+    timings: Dict[int, float] = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        handler = bcrypt.using(rounds=rounds)
+        durations = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            handler.hash("calibration-password")
+            durations.append((time.perf_counter() - started) * 1000)
+        timings[rounds] = round(statistics.median(durations), 1)
+        if timings[rounds] > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
 
 # ------ Generación de ID único a partir del email ------
 def generate_user_id(email: str) -> str:
     """Genera un ID único a partir del email."""
     return hashlib.sha256(email.lower().encode()).hexdigest()[:10]
 
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Utilidades de seguridad.")
+    parser.add_argument("--calibrate", action="store_true", help="Calcula el coste de bcrypt adecuado para este equipo.")
+    parser.add_argument("--target-ms", type=float, default=100, help="Latencia objetivo de un hash (ms).")
+    args = parser.parse_args()
+    if args.calibrate:
+        rounds, timings = calibrate_bcrypt_rounds(args.target_ms)
+        for cost, elapsed in timings.items():
+            print(f"  coste {cost:2d}: {elapsed:8.1f} ms")
+        print(f"BCRYPT_ROUNDS={rounds}")
+    else:
+        parser.print_help()
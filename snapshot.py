@@ -0,0 +1,327 @@
+import os, re, json, time, shutil, logging, threading
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from database import shard_batches
+from models import UserDB, DailyLogDB, MonthlyLogSummaryDB
+from scheduler import utcnow
+
+# numpy es opcional: sin él no se pueden generar ni abrir snapshots
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger("main.snapshot")
+
+# ------ Configuración ------
+# Directorio de los snapshots y número de snapshots que se conservan
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))
+# Tamaño de las listas IN al releer los usuarios modificados
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", 500))
+# Con pyarrow instalado se escribe además un fichero Parquet por tabla
+SNAPSHOT_PARQUET = os.getenv("SNAPSHOT_PARQUET", "1") == "1"
+# Horas tras las que se borra un directorio .tmp abandonado por una exportación interrumpida
+SNAPSHOT_TMP_MAX_AGE_HOURS = float(os.getenv("SNAPSHOT_TMP_MAX_AGE_HOURS", 6))
+
+# Versión del formato en disco: un snapshot de otra versión no sirve de base para uno incremental
+SNAPSHOT_FORMAT = 2
+LATEST_FILE = "LATEST"
+# Nombre de los directorios de snapshot (created_at con el formato %Y%m%dT%H%M%S%fZ)
+SNAPSHOT_NAME = re.compile(r"^\d{8}T\d{12}Z$")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+EPOCH = datetime(1970, 1, 1)
+
+
+class SnapshotTable:
+    """Tabla exportada: filas ordenadas por (usuario, fecha) con un fichero .npy por columna y, para
+    las columnas que admiten nulos, una máscara de presencia `<columna>_present.npy` (False = nulo)."""
+
+    def __init__(self, model, date_column: str):
+        self.model = model
+        self.name = model.__tablename__
+        self.date_column = date_column
+        fields = [col for col in model.__table__.columns if col.name not in ("user_id", date_column)]
+        self.columns = {col.name: ("int32" if col.type.python_type is int else "float64") for col in fields}
+        self.nullable = [col.name for col in fields if col.nullable]
+
+    @property
+    def files(self) -> List[str]:
+        return [self.date_column, *self.columns, *(f"{name}_present" for name in self.nullable)]
+
+
+# Logs diarios y nivel mensual compactado, con el mismo diccionario de usuarios
+TABLES = [SnapshotTable(DailyLogDB, "log_date"), SnapshotTable(MonthlyLogSummaryDB, "month")]
+
+
+class Snapshot:
+    """Snapshot abierto con memory-map: cada columna se lee del disco bajo demanda y los datos de un
+    usuario son vistas sobre los ficheros, sin copias.
+
+        snapshot = open_snapshot()
+        rows = snapshot.user_rows("3fa4c1b2d9")      # {"log_date": ..., "steps": ..., "steps_present": ...}
+    """
+
+    def __init__(self, path: str, mmap_mode: Optional[str] = "r"):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._mmap_mode = mmap_mode
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.user_ids = self._load("user_ids")          # Ordenados: la posición de un usuario es su índice
+        self.user_versions = self._load("user_versions")
+        self.user_updated = self._load("user_updated")   # updated_at en segundos desde 1970 (0 = nunca)
+
+    def _load(self, *parts: str):
+        return np.load(os.path.join(self.path, *parts) + ".npy", mmap_mode=self._mmap_mode)
+
+    def column(self, table: str, name: str):
+        return self._load(table, name)
+
+    def offsets(self, table: str):
+        """Las filas del usuario i están en [offsets[i], offsets[i + 1])."""
+        return self._load(table, "offsets")
+
+    def user_rows(self, user_id: str, table: str = "logs") -> Dict[str, "np.ndarray"]:
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position == len(self.user_ids) or self.user_ids[position] != user_id:
+            raise KeyError(user_id)
+        offsets = self.offsets(table)
+        low, high = int(offsets[position]), int(offsets[position + 1])
+        return {name: self.column(table, name)[low:high] for name in self.manifest["tables"][table]["files"]}
+
+
+def open_snapshot(directory: str = SNAPSHOT_DIR, name: Optional[str] = None, mmap_mode: Optional[str] = "r") -> Optional[Snapshot]:
+    """Abre el snapshot indicado o, por defecto, el último generado (None si no hay ninguno)."""
+    if name is None:
+        try:
+            with open(os.path.join(directory, LATEST_FILE), encoding="utf-8") as latest:
+                name = latest.read().strip()
+        except FileNotFoundError:
+            return None
+    return Snapshot(os.path.join(directory, name), mmap_mode)
+
+
+# ------ Exportación ------
+_export_lock = threading.Lock()
+
+def current_versions() -> Dict[str, Tuple[int, int]]:
+    """(data_version, updated_at en segundos) de todos los usuarios de todos los shards. La versión sola no
+    basta: una cuenta eliminada y registrada de nuevo con el mismo email recupera el id y vuelve a la versión 0."""
+    versions = {}
+    for session_factory, _ in shard_batches():
+        db = session_factory()
+        try:
+            versions.update(
+                (user_id, (version or 0, int((updated_at - EPOCH).total_seconds()) if updated_at else 0))
+                for user_id, version, updated_at in db.query(UserDB.id, UserDB.data_version, UserDB.updated_at)
+            )
+        finally:
+            db.close()
+    return versions
+
+
+def fetch_rows(table: SnapshotTable, user_ids: Optional[List[str]]) -> list:
+    """Filas de la tabla de los usuarios indicados (de todos si `user_ids` es None)."""
+    model = table.model
+    columns = [model.user_id, getattr(model, table.date_column), *(getattr(model, name) for name in table.columns)]
+    rows = []
+    for session_factory, chunk in shard_batches(user_ids, SNAPSHOT_CHUNK_SIZE):
+        db = session_factory()
+        try:
+            query = db.query(*columns)
+            if chunk is not None:
+                query = query.filter(model.user_id.in_(chunk))
+            rows.extend(query.yield_per(SNAPSHOT_CHUNK_SIZE))
+        finally:
+            db.close()
+    return rows
+
+
+def rows_to_arrays(table: SnapshotTable, rows: list, user_index: Dict[str, int]) -> Dict[str, "np.ndarray"]:
+    """Convierte filas (user_id, fecha, columnas...) en arrays, con `user_index` como posición del usuario."""
+    count = len(rows)
+    arrays = {
+        "user_index": np.fromiter((user_index[row[0]] for row in rows), dtype="int64", count=count),
+        table.date_column: np.fromiter(
+            (row[1].toordinal() - EPOCH_ORDINAL for row in rows), dtype="int64", count=count
+        ).astype("datetime64[D]"),
+    }
+    for position, (name, dtype) in enumerate(table.columns.items(), start=2):
+        raw = [row[position] for row in rows]
+        arrays[name] = np.fromiter((0 if value is None else value for value in raw), dtype=dtype, count=count)
+        if name in table.nullable:
+            arrays[f"{name}_present"] = np.fromiter((value is not None for value in raw), dtype=bool, count=count)
+    return arrays
+
+
+def write_parquet(path: str, table: SnapshotTable, user_ids, arrays: Dict[str, "np.ndarray"]):
+    import pyarrow as pa, pyarrow.parquet as pq
+    columns = {
+        "user_id": pa.array(user_ids[arrays["user_index"]]),
+        table.date_column: pa.array(arrays[table.date_column]),
+    }
+    for name in table.columns:
+        mask = ~arrays[f"{name}_present"] if name in table.nullable else None
+        columns[name] = pa.array(arrays[name], mask=mask)
+    pq.write_table(pa.table(columns), path)
+
+
+def export_snapshot(directory: str = SNAPSHOT_DIR, full: bool = False, parquet: bool = SNAPSHOT_PARQUET) -> dict:
+    """Genera un snapshot columnar de `logs` y `logs_monthly` y lo marca como el último. Devuelve su manifiesto.
+
+    Es incremental: parte del último snapshot y solo relee de la base de datos las filas de los usuarios
+    cuya data_version o updated_at ha cambiado (escrituras, compactación, cuentas registradas de nuevo); los usuarios eliminados desaparecen y el
+    resto se copia del snapshot anterior. Cada snapshot se escribe en un directorio nuevo que no se
+    modifica después, así que se puede leer con memory-map mientras se genera el siguiente."""
+    if np is None:
+        raise RuntimeError("numpy no está instalado: no se pueden generar snapshots.")
+    with _export_lock:
+        return _export(directory, full, parquet)
+
+
+def _export(directory: str, full: bool, parquet: bool) -> dict:
+    started, created_at = time.perf_counter(), utcnow()
+    os.makedirs(directory, exist_ok=True)
+    base = None if full else open_snapshot(directory)
+    if base is not None and (
+        base.manifest.get("format") != SNAPSHOT_FORMAT
+        or any(base.manifest["tables"].get(table.name, {}).get("columns") != table.columns for table in TABLES)
+    ):
+        logger.info(f"El snapshot {base.name} tiene otro formato: se genera uno completo.")
+        base = None
+
+    # Las versiones se leen antes que las filas: si un usuario escribe mientras tanto, el snapshot guarda
+    # su versión anterior y sus filas se vuelven a leer en el siguiente.
+    versions = current_versions()
+    user_ids = np.array(sorted(versions), dtype=str)
+    user_index = {user_id: position for position, user_id in enumerate(user_ids.tolist())}
+    user_versions = np.fromiter((versions[user_id][0] for user_id in user_ids.tolist()), dtype="int64", count=len(user_ids))
+    user_updated = np.fromiter((versions[user_id][1] for user_id in user_ids.tolist()), dtype="int64", count=len(user_ids))
+
+    changed, kept = None, None
+    if base is not None:
+        previous = dict(zip(base.user_ids.tolist(), zip(base.user_versions.tolist(), base.user_updated.tolist())))
+        changed = [user_id for user_id in user_index if previous.get(user_id) != versions[user_id]]
+        # Usuarios del snapshot anterior que siguen existiendo con la misma versión y fecha de modificación
+        kept = np.fromiter(
+            (versions.get(user_id) == state for user_id, state in previous.items()), dtype=bool, count=len(previous)
+        )
+
+    name = created_at.strftime("%Y%m%dT%H%M%S%fZ")
+    path, tmp_path = os.path.join(directory, name), os.path.join(directory, name + ".tmp")
+    os.makedirs(tmp_path)
+    parquet = parquet and _has_pyarrow()
+    tables = {}
+    try:
+        np.save(os.path.join(tmp_path, "user_ids.npy"), user_ids)
+        np.save(os.path.join(tmp_path, "user_versions.npy"), user_versions)
+        np.save(os.path.join(tmp_path, "user_updated.npy"), user_updated)
+        for table in TABLES:
+            # Filas releídas de la base de datos (todas en un snapshot completo)
+            rows = [row for row in fetch_rows(table, changed) if row[0] in user_index]
+            parts = [rows_to_arrays(table, rows, user_index)]
+            if base is not None:
+                counts = np.diff(base.offsets(table.name))
+                keep_rows = np.repeat(kept, counts)
+                new_positions = np.searchsorted(user_ids, base.user_ids) if len(user_ids) else np.zeros(len(base.user_ids), dtype="int64")
+                copied = {"user_index": np.repeat(new_positions, counts)[keep_rows]}
+                for file in table.files:
+                    copied[file] = base.column(table.name, file)[keep_rows]
+                parts.append(copied)
+            arrays = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+            order = np.lexsort((arrays[table.date_column], arrays["user_index"]))
+            arrays = {key: values[order] for key, values in arrays.items()}
+            offsets = np.zeros(len(user_ids) + 1, dtype="int64")
+            np.cumsum(np.bincount(arrays["user_index"], minlength=len(user_ids)), out=offsets[1:])
+
+            os.makedirs(os.path.join(tmp_path, table.name))
+            np.save(os.path.join(tmp_path, table.name, "offsets.npy"), offsets)
+            for file in table.files:
+                np.save(os.path.join(tmp_path, table.name, f"{file}.npy"), arrays[file])
+            if parquet:
+                write_parquet(os.path.join(tmp_path, f"{table.name}.parquet"), table, user_ids, arrays)
+            tables[table.name] = {
+                "rows": int(offsets[-1]),
+                "reloaded_rows": len(rows),
+                "date_column": table.date_column,
+                "columns": table.columns,
+                "files": table.files,
+            }
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "name": name,
+            "created_at": created_at.isoformat(),
+            "base": base.name if base is not None else None,
+            "users": len(user_ids),
+            "changed_users": len(user_ids) if changed is None else len(changed),
+            "tables": tables,
+            "parquet": parquet,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.rename(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # El puntero LATEST se sustituye de forma atómica
+    with open(os.path.join(directory, LATEST_FILE + ".tmp"), "w", encoding="utf-8") as latest:
+        latest.write(name)
+    os.replace(os.path.join(directory, LATEST_FILE + ".tmp"), os.path.join(directory, LATEST_FILE))
+    prune_snapshots(directory)
+    logger.info(
+        f"Snapshot {name} generado en {manifest['duration_ms']} ms: {manifest['users']} usuarios "
+        f"({manifest['changed_users']} releídos), {tables['logs']['rows']} logs."
+    )
+    return manifest
+
+
+def prune_snapshots(directory: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP, tmp_max_age_hours: float = SNAPSHOT_TMP_MAX_AGE_HOURS):
+    """Borra los snapshots más antiguos, conservando los `keep` últimos (todos si `keep` <= 0), y los directorios
+    .tmp de exportaciones interrumpidas con más de `tmp_max_age_hours` horas. Solo se tocan directorios con
+    nombre de snapshot: el resto del contenido de `directory` se respeta. En Linux, un proceso que tenga
+    abierto con memory-map un snapshot borrado puede seguir leyéndolo."""
+    snapshots, stale_tmp = [], []
+    tmp_deadline = time.time() - tmp_max_age_hours * 3600
+    for entry in os.scandir(directory):
+        if not entry.is_dir():
+            continue
+        if entry.name.endswith(".tmp"):
+            if SNAPSHOT_NAME.match(entry.name[:-len(".tmp")]) and entry.stat().st_mtime < tmp_deadline:
+                stale_tmp.append(entry.name)
+        elif SNAPSHOT_NAME.match(entry.name) and os.path.isfile(os.path.join(entry.path, "manifest.json")):
+            snapshots.append(entry.name)
+    for name in stale_tmp:
+        logger.info(f"Borrando la exportación interrumpida {name}.")
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    if keep <= 0:
+        return
+    for name in sorted(snapshots)[:-keep]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        logger.info("pyarrow no está instalado: el snapshot se genera sin ficheros Parquet.")
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Snapshot columnar (.npy con memory-map) de los logs.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="Directorio de los snapshots.")
+    parser.add_argument("--full", action="store_true", help="Relee todos los logs en lugar de partir del último snapshot.")
+    parser.add_argument("--no-parquet", action="store_true", help="No genera los ficheros Parquet aunque pyarrow esté instalado.")
+    args = parser.parse_args()
+    result = export_snapshot(args.dir, full=args.full, parquet=not args.no_parquet)
+    print(
+        f"Snapshot {result['name']}: {result['users']} usuarios ({result['changed_users']} releídos), "
+        f"{result['tables']['logs']['rows']} logs y {result['tables']['logs_monthly']['rows']} resúmenes mensuales."
+    )
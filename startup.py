@@ -0,0 +1,86 @@
+# Medición del arranque en frío: fases del arranque en el proceso y tiempo de importación por módulo.
+# Uso: python startup.py [módulo]  (por defecto, main). Devuelve código 1 si se supera el objetivo.
+
+import os, re, sys, time, logging, subprocess
+from typing import Dict, List, Optional, Tuple
+
+# Objetivo de arranque en frío (milisegundos hasta la primera petición)
+COLD_START_TARGET_MS = float(os.getenv("COLD_START_TARGET_MS", 1500))
+
+logger = logging.getLogger("main.startup")
+
+
+class StartupReport:
+    """Tiempos (ms) de cada fase del arranque, medidos desde la importación de este módulo."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.first_request_ms: Optional[float] = None
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def mark(self, phase: str):
+        self.phases[phase] = self._elapsed_ms()
+
+    def mark_first_request(self):
+        self.first_request_ms = self._elapsed_ms()
+        message = f"Primera petición servida a los {self.first_request_ms} ms del arranque (objetivo {COLD_START_TARGET_MS:g} ms)."
+        if self.first_request_ms > COLD_START_TARGET_MS:
+            logger.warning(message)
+        else:
+            logger.info(message)
+
+    def as_dict(self) -> dict:
+        return {
+            "phases_ms": self.phases,
+            "first_request_ms": self.first_request_ms,
+            "target_ms": COLD_START_TARGET_MS,
+        }
+
+
+startup_report = StartupReport()
+
+
+class FirstRequestTimer:
+    """Middleware ASGI que anota cuándo termina la primera petición HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and startup_report.first_request_ms is None:
+            startup_report.mark_first_request()
+
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+def import_times(module: str = "main") -> Tuple[float, List[Tuple[str, float]]]:
+    """Importa `module` en un proceso nuevo con `-X importtime` y devuelve el tiempo total (ms)
+    y el tiempo acumulado de cada una de sus importaciones directas, de mayor a menor."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4), int(match.group(2)) / 1000))
+    total = next(cumulative for indent, name, cumulative in entries if name == module and indent == 1)
+    # Las importaciones directas del módulo aparecen con un nivel más de sangría
+    children = [(name, cumulative) for indent, name, cumulative in entries if indent == 3]
+    return total, sorted(children, key=lambda item: item[1], reverse=True)
+
+
+if __name__ == "__main__":
+    target_module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    total, children = import_times(target_module)
+    print(f"Importación de '{target_module}': {total:.1f} ms (objetivo de arranque: {COLD_START_TARGET_MS:g} ms)")
+    for name, cumulative in children[:20]:
+        print(f"  {cumulative:8.1f} ms  {name}")
+    sys.exit(1 if total > COLD_START_TARGET_MS else 0)
@@ -0,0 +1,86 @@
+import requests
+import json
+from datetime import date, timedelta
+from typing import Optional, Dict, Any
+
+BASE_URL = "http://127.0.0.1:8000"
+USER_EMAIL = "user8@api.com"
+USER_PWD = "SecurePass888"                  # Debe tener 8+ caracteres
+
+SIGNUP_DATA = {
+    "name": "User8",
+    "age": 36,
+    "email": USER_EMAIL,
+    "password": USER_PWD
+}
+
+# Fecha anterior al límite de retención por defecto (LOG_RETENTION_DAYS=730). El servidor se arranca
+# sin COMPACTION_CRON: ese mes no está compactado y se puede rellenar
+DATE_OLD = date.today() - timedelta(days=1000)
+
+LOG_DATA_OLD = {
+    "log_date": DATE_OLD.isoformat(),
+    "steps": 4000,
+    "mood": 6
+}
+
+# --- FUNCIÓN AUXILIAR PARA IMPRIMIR LA RESPUESTA ---
+def print_response(step_number: int, title: str, response: requests.Response) -> Optional[Dict[str, Any]]:
+    """Función auxiliar para imprimir la respuesta de la API y devolver el JSON."""
+    print(f"\n--- {step_number}. {title} ---")
+    print(f"Estado: {response.status_code}")
+
+    data = None
+    try:
+        data = response.json()
+        print("Respuesta:", json.dumps(data, indent=2))
+    except requests.exceptions.JSONDecodeError:
+        print("Respuesta (sin JSON):", response.text)
+
+    print("-" * 30)
+    return data
+# ----------------------------------------------------
+
+def signup_and_login():
+    """Registra al usuario (si no existe) y devuelve las cabeceras con el access token."""
+    response = requests.post(f"{BASE_URL}/auth/signup", json=SIGNUP_DATA)
+    print_response(1, "POST /auth/signup", response)
+    response = requests.post(f"{BASE_URL}/auth/login", json={"email": USER_EMAIL, "password": USER_PWD})
+    data = print_response(2, "POST /auth/login", response)
+    if response.status_code == 200 and data:
+        return {"Authorization": f"Bearer {data['access_token']}", "Content-Type": "application/json"}
+    print("ERROR FATAL: Login fallido.")
+    return None
+
+def step_3_backfill_old_log(headers: Dict[str, str]):
+    """Sin compactación, un log antiguo se puede registrar: su mes no tiene resumen en logs_monthly."""
+    response = requests.post(f"{BASE_URL}/user/logs", headers=headers, json=LOG_DATA_OLD)
+    print_response(3, f"POST /user/logs ({DATE_OLD}, mes sin compactar)", response)
+    if response.status_code == 201:
+        print("Resultado: ÉXITO - Log antiguo registrado.")
+    else:
+        print("ERROR: Se esperaba un 201 al rellenar un mes sin compactar.")
+
+def step_4_update_old_log(headers: Dict[str, str]):
+    """Y también se puede corregir."""
+    response = requests.put(f"{BASE_URL}/user/logs", headers=headers, json={**LOG_DATA_OLD, "steps": 4500})
+    print_response(4, f"PUT /user/logs ({DATE_OLD}, mes sin compactar)", response)
+    if response.status_code == 200:
+        print("Resultado: ÉXITO - Log antiguo corregido.")
+    else:
+        print("ERROR: Se esperaba un 200 al corregir un mes sin compactar.")
+
+def step_5_delete_account(headers: Dict[str, str]):
+    """Borra la cuenta para poder repetir la prueba."""
+    response = requests.delete(f"{BASE_URL}/user/account", headers=headers)
+    print_response(5, "DELETE /user/account", response)
+
+if __name__ == "__main__":
+    print("==================================================")
+    print("INICIANDO PRUEBA 8: LOGS ANTIGUOS SIN COMPACTACIÓN")
+    print("==================================================")
+    auth_headers = signup_and_login()
+    if auth_headers:
+        step_3_backfill_old_log(auth_headers)
+        step_4_update_old_log(auth_headers)
+        step_5_delete_account(auth_headers)
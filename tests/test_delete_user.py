@@ -0,0 +1,64 @@
+import requests
+import json
+from typing import Optional, Dict, Any
+
+BASE_URL = "http://127.0.0.1:8000"
+USER_EMAIL = "user5@api.com"
+USER_PWD = "SecurePass555"                  # Debe tener 8+ caracteres
+
+SIGNUP_DATA = {
+    "name": "User5",
+    "age": 35,
+    "email": USER_EMAIL,
+    "password": USER_PWD
+}
+
+# --- FUNCIÓN AUXILIAR PARA IMPRIMIR LA RESPUESTA ---
+def print_response(step_number: int, title: str, response: requests.Response) -> Optional[Dict[str, Any]]:
+    """Función auxiliar para imprimir la respuesta de la API y devolver el JSON."""
+    print(f"\n--- {step_number}. {title} ---")
+    print(f"Estado: {response.status_code}")
+    
+    data = None
+    try:
+        data = response.json()
+        print("Respuesta:", json.dumps(data, indent=2))
+    except requests.exceptions.JSONDecodeError:
+        print("Respuesta (sin JSON):", response.text)
+        
+    print("-" * 30)
+    return data
+# ----------------------------------------------------
+
+def signup_and_login() -> Optional[Dict[str, str]]:
+    """Crea la cuenta (si no existe) e inicia sesión."""
+    response = requests.post(f"{BASE_URL}/auth/signup", json=SIGNUP_DATA)
+    print_response(1, "POST /auth/signup (Crear Usuario)", response)
+
+    login_data = {"email": USER_EMAIL, "password": USER_PWD}
+    response = requests.post(f"{BASE_URL}/auth/login", json=login_data)
+    data = print_response(2, "POST /auth/login (Obtener Token)", response)
+    if response.status_code == 200 and data:
+        return {"Authorization": f"Bearer {data['access_token']}"}
+    print("ERROR FATAL: Login fallido.")
+    return None
+
+def delete_account(headers: Dict[str, str]):
+    """Elimina la cuenta y comprueba que el token deja de ser válido."""
+    response = requests.delete(f"{BASE_URL}/user/account", headers=headers)
+    print_response(3, "DELETE /user/account (Eliminar Cuenta)", response)
+
+    response = requests.get(f"{BASE_URL}/user/account", headers=headers)
+    print_response(4, "GET /user/account (Tras eliminar)", response)
+    if response.status_code == 401:
+        print("Resultado: ÉXITO - La cuenta ya no existe.")
+    else:
+        print("ERROR: La cuenta sigue accesible.")
+
+if __name__ == "__main__":
+    print("==================================================")
+    print("INICIANDO PRUEBA: ELIMINACIÓN DE CUENTA")
+    print("==================================================")
+    auth_headers = signup_and_login()
+    if auth_headers:
+        delete_account(auth_headers)
@@ -0,0 +1,83 @@
+import requests
+import json
+from typing import Optional, Dict, Any
+
+BASE_URL = "http://127.0.0.1:8000"
+USER_EMAIL = "user6@api.com"
+USER_PWD = "SecurePass666"                  # Debe tener 8+ caracteres
+
+SIGNUP_DATA = {
+    "name": "User6",
+    "age": 41,
+    "email": USER_EMAIL,
+    "password": USER_PWD
+}
+
+# --- FUNCIÓN AUXILIAR PARA IMPRIMIR LA RESPUESTA ---
+def print_response(step_number: int, title: str, response: requests.Response) -> Optional[Dict[str, Any]]:
+    """Función auxiliar para imprimir la respuesta de la API y devolver el JSON."""
+    print(f"\n--- {step_number}. {title} ---")
+    print(f"Estado: {response.status_code}")
+    
+    data = None
+    try:
+        data = response.json()
+        print("Respuesta:", json.dumps(data, indent=2))
+    except requests.exceptions.JSONDecodeError:
+        print("Respuesta (sin JSON):", response.text)
+        
+    print("-" * 30)
+    return data
+# ----------------------------------------------------
+
+def signup_and_login() -> Optional[Dict[str, str]]:
+    """Crea la cuenta (si no existe) e inicia sesión. Devuelve los tokens."""
+    response = requests.post(f"{BASE_URL}/auth/signup", json=SIGNUP_DATA)
+    print_response(1, "POST /auth/signup (Crear Usuario)", response)
+
+    login_data = {"email": USER_EMAIL, "password": USER_PWD}
+    response = requests.post(f"{BASE_URL}/auth/login", json=login_data)
+    data = print_response(2, "POST /auth/login (Obtener Tokens)", response)
+    if response.status_code == 200 and data:
+        return data
+    print("ERROR FATAL: Login fallido.")
+    return None
+
+def rotate_and_reuse(tokens: Dict[str, str]):
+    """Renueva los tokens y comprueba que el refresh token anterior ya no sirve."""
+    old_refresh = tokens["refresh_token"]
+    response = requests.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": old_refresh})
+    data = print_response(3, "POST /auth/refresh (Rotar Tokens)", response)
+    if response.status_code != 200 or not data:
+        print("ERROR: No se han podido renovar los tokens.")
+        return None
+
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    response = requests.get(f"{BASE_URL}/user/account", headers=headers)
+    print_response(4, "GET /user/account (Con el nuevo access token)", response)
+
+    # Reutilizar el token rotado revoca toda la familia, incluido el token nuevo
+    response = requests.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": old_refresh})
+    print_response(5, "POST /auth/refresh (Reutilizar token rotado)", response)
+    response = requests.post(f"{BASE_URL}/auth/refresh", json={"refresh_token": data["refresh_token"]})
+    print_response(6, "POST /auth/refresh (Token nuevo tras la revocación)", response)
+    if response.status_code == 401:
+        print("Resultado: ÉXITO - La reutilización ha revocado la familia de tokens.")
+    else:
+        print("ERROR: El token nuevo sigue siendo válido.")
+    return headers
+
+def revoke_all(headers: Dict[str, str]):
+    """Revoca todas las sesiones del usuario."""
+    response = requests.delete(f"{BASE_URL}/user/sessions", headers=headers)
+    print_response(7, "DELETE /user/sessions (Revocar todas las sesiones)", response)
+
+if __name__ == "__main__":
+    print("==================================================")
+    print("INICIANDO PRUEBA: REFRESH TOKENS")
+    print("==================================================")
+    login_tokens = signup_and_login()
+    if login_tokens:
+        auth_headers = rotate_and_reuse(login_tokens)
+        if auth_headers:
+            revoke_all(auth_headers)
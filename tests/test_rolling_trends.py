@@ -0,0 +1,79 @@
+import requests
+import json
+from datetime import date, timedelta
+from typing import Optional, Dict, Any
+
+
+BASE_URL = "http://127.0.0.1:8000"
+USER_EMAIL = "user3@api.com"
+USER_PWD = "SecurePass333"
+START_DATE = date.today() - timedelta(days=30)
+
+
+# --- Funciones Auxiliares ---
+def print_response(title: str, response: requests.Response) -> Optional[Dict[str, Any]]:
+    """Función auxiliar para imprimir la respuesta de la API."""
+    print(f"\n--- {title} ---")
+    print(f"Estado: {response.status_code}")
+    data = None
+    try:
+        data = response.json()
+        print("Respuesta:", json.dumps(data, indent=2))
+    except requests.exceptions.JSONDecodeError:
+        print("Respuesta (Error sin JSON):", response.text)
+        
+    print("-" * 30)
+    return data
+
+def login_and_get_token(email: str, pwd: str) -> Optional[Dict[str, str]]:
+    """Intenta iniciar sesión y devuelve el diccionario de headers con el token si tiene éxito."""
+    login_data = {"email": email, "password": pwd}
+    response = requests.post(f"{BASE_URL}/auth/login", json=login_data)
+    data = print_response("POST /auth/login (Obtener Token)", response) 
+    
+    if response.status_code == 200 and data:
+        token = data.get("access_token")
+        if token:
+            return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    print("ERROR FATAL: Login fallido. No se pudo obtener el token de acceso.")
+    return None
+
+def run_rolling_test(headers: Dict[str, str], params: Dict[str, Any], title: str):
+    """Ejecuta la consulta GET /user/trends/rolling con los parámetros indicados."""
+    response = requests.get(f"{BASE_URL}/user/trends/rolling", headers=headers, params=params)
+    print_response(f"GET /user/trends/rolling ({title})", response)
+    
+    if response.status_code != 200:
+        print(f"ATENCIÓN: La prueba {title} falló con el código de estado {response.status_code}.")
+    else:
+        print(f"ÉXITO: La prueba {title} completó satisfactoriamente.")
+
+
+if __name__ == "__main__":
+    print("="*50)
+    print("INICIANDO PRUEBAS: SERIES DE MEDIAS MÓVILES")
+    print("="*50)
+
+    headers = login_and_get_token(USER_EMAIL, USER_PWD)
+
+    if headers:
+        # Medias móviles de 7 y 28 días de pasos y ánimo
+        run_rolling_test(headers, {
+            "start": START_DATE.isoformat(),
+            "metrics": ["steps", "mood"],
+            "windows": [7, 28],
+        }, "AVG 7d/28d")
+
+        # Mínimos y máximos móviles de 7 días de sueño
+        run_rolling_test(headers, {
+            "start": START_DATE.isoformat(),
+            "metrics": ["sleep_hours"],
+            "windows": [7],
+            "stats": ["min", "max"],
+        }, "MIN/MAX 7d")
+    else:
+        print("PRUEBAS NO EJECUTADAS debido al fallo de Login.")
+        
+    print("PRUEBAS DE SERIES MÓVILES COMPLETADAS.")
+    print("="*50)
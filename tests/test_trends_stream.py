@@ -0,0 +1,62 @@
+import requests
+import threading
+import time
+from datetime import date
+from typing import Optional
+
+BASE_URL = "http://127.0.0.1:8000"
+USER_EMAIL = "user7@api.com"
+USER_PWD = "SecurePass777"                  # Debe tener 8+ caracteres
+
+SIGNUP_DATA = {
+    "name": "User7",
+    "age": 29,
+    "email": USER_EMAIL,
+    "password": USER_PWD
+}
+
+def signup_and_login() -> Optional[str]:
+    """Crea la cuenta (si no existe) e inicia sesión. Devuelve el access token."""
+    requests.post(f"{BASE_URL}/auth/signup", json=SIGNUP_DATA)
+    response = requests.post(f"{BASE_URL}/auth/login", json={"email": USER_EMAIL, "password": USER_PWD})
+    print(f"--- POST /auth/login --- Estado: {response.status_code}")
+    if response.status_code == 200:
+        return response.json()["access_token"]
+    print("ERROR FATAL: Login fallido.")
+    return None
+
+def save_logs(token: str):
+    """Guarda un log y lo actualiza mientras el canal en vivo está abierto."""
+    headers = {"Authorization": f"Bearer {token}"}
+    time.sleep(1)
+    log = {"log_date": date.today().isoformat(), "steps": 6000, "mood": 4}
+    response = requests.post(f"{BASE_URL}/user/logs", json=log, headers=headers)
+    if response.status_code == 400:
+        response = requests.put(f"{BASE_URL}/user/logs", json=log, headers=headers)
+    print(f"--- Log guardado --- Estado: {response.status_code}")
+
+def listen(token: str, max_events: int = 3):
+    """Escucha el canal SSE (token como parámetro, como haría un EventSource del navegador)."""
+    url = f"{BASE_URL}/user/trends/stream?metric_type=avg&last_days=7&access_token={token}"
+    with requests.get(url, stream=True, timeout=30) as response:
+        print(f"--- GET /user/trends/stream --- Estado: {response.status_code}")
+        received = 0
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or line.startswith(":"):
+                continue
+            print(line)
+            if line.startswith("event:"):
+                received += 1
+            if received >= max_events:
+                break
+    if received >= max_events:
+        print("Resultado: ÉXITO - Resumen inicial, log y resumen recalculado recibidos sin polling.")
+
+if __name__ == "__main__":
+    print("==================================================")
+    print("INICIANDO PRUEBA: CANAL EN VIVO DE TENDENCIAS (SSE)")
+    print("==================================================")
+    access_token = signup_and_login()
+    if access_token:
+        threading.Thread(target=save_logs, args=(access_token,)).start()
+        listen(access_token)
@@ -1,5 +1,6 @@
 import requests
 import json
+from datetime import date, timedelta
 from typing import Optional, Dict, Any
 from enum import Enum
 
@@ -62,6 +63,46 @@ def run_trends_test(headers: Dict[str, str], last_days: int, metric: MetricType)
         print(f"ÉXITO: La prueba {metric_name} completó satisfactoriamente.")
 
 
+# ----------------------------------------------------------------------
+# COMPARACIÓN ENTRE PERÍODOS
+# ----------------------------------------------------------------------
+
+def run_comparison_test(headers: Dict[str, str], last_days: int, metric: MetricType, compare_to: str):
+    """Ejecuta la consulta GET /user/trends comparando con un período de referencia."""
+    url = f"{BASE_URL}/user/trends?last_days={last_days}&metric_type={metric.value}&compare_to={compare_to}"
+    
+    response = requests.get(url, headers=headers)
+    print_response(f"GET /user/trends (Tipo: {metric.name}, compare_to={compare_to})", response)
+    
+    if response.status_code != 200:
+        print(f"ATENCIÓN: La comparación {compare_to} falló con el código de estado {response.status_code}.")
+    else:
+        print(f"ÉXITO: La comparación {compare_to} completó satisfactoriamente.")
+
+
+def run_overlapping_comparison_test(headers: Dict[str, str]):
+    """Con un rango de más de 365 días, compare_to=previous_year produce períodos que se solapan.
+    Cada período debe agregarse por separado: el anterior coincide con la consulta directa de su rango."""
+    overlap_day = date.today() - timedelta(days=380)      # Cae en ambos períodos
+    requests.post(f"{BASE_URL}/user/logs", headers=headers, json={"log_date": overlap_day.isoformat(), "steps": 7000})
+
+    start = (date.today() - timedelta(days=400)).isoformat()
+    url = f"{BASE_URL}/user/trends?start={start}&end={date.today().isoformat()}&metric_type=avg&compare_to=previous_year"
+    response = requests.get(url, headers=headers)
+    data = print_response("GET /user/trends (rango de 400 días, compare_to=previous_year)", response)
+    if response.status_code != 200 or not data:
+        print(f"ATENCIÓN: La comparación con solapamiento falló con el código de estado {response.status_code}.")
+        return
+
+    previous = data["previous"]
+    url = f"{BASE_URL}/user/trends?start={previous['start']}&end={previous['end']}&metric_type=avg"
+    direct = print_response("GET /user/trends (período anterior consultado directamente)", requests.get(url, headers=headers))
+    if direct and previous["metrics"] == direct:
+        print("ÉXITO: El período anterior incluye los días solapados.")
+    else:
+        print("ATENCIÓN: El período anterior no coincide con la consulta directa de su rango.")
+
+
 # ----------------------------------------------------------------------
 # FLUJO PRINCIPAL DE PRUEBA
 # ----------------------------------------------------------------------
@@ -85,6 +126,13 @@ if __name__ == "__main__":
 
         # 4. PROBAR MAX (MÁXIMO)
         run_trends_test(headers, DAYS_TO_QUERY, MetricType.MAXIMUM)
+
+        # 5. COMPARAR CON EL PERÍODO ANTERIOR Y CON EL AÑO ANTERIOR
+        run_comparison_test(headers, DAYS_TO_QUERY, MetricType.AVERAGE, "previous_period")
+        run_comparison_test(headers, DAYS_TO_QUERY, MetricType.AVERAGE, "previous_year")
+
+        # 6. RANGO DE MÁS DE UN AÑO: LOS PERÍODOS SE SOLAPAN
+        run_overlapping_comparison_test(headers)
         
         print("\n" + "="*50)
     else:
@@ -0,0 +1,164 @@
+import os, threading, logging
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Iterable, Optional
+
+from models import METRIC_COLUMNS
+
+# numpy es opcional: sin él la caché queda desactivada y las consultas van a SQLite
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger("main.timeseries_cache")
+
+# Presupuesto de memoria de la caché (MB). 0 la desactiva.
+TRENDS_CACHE_MB = float(os.getenv("TRENDS_CACHE_MB", 64))
+
+# Tipo de cada métrica en los arrays: int32 para las columnas enteras y float64 para las decimales
+METRIC_DTYPES = {col.name: ("int32" if col.type.python_type is int else "float64") for col in METRIC_COLUMNS}
+# Coste fijo estimado de cada usuario en caché (objetos Python y entrada del diccionario)
+SERIES_OVERHEAD_BYTES = 1024
+
+
+class UserSeries:
+    """Historial de logs diarios de un usuario en arrays columnares: los ordinales de las fechas
+    (ordenados) y, por métrica, un array de valores y una máscara de presencia (False = nulo).
+    Es inmutable: los cambios crean una serie nueva, así que un lector nunca ve arrays a medio actualizar."""
+    __slots__ = ("version", "days", "values", "present", "nbytes")
+
+    def __init__(self, version: int, days, values: Dict[str, "np.ndarray"], present: Dict[str, "np.ndarray"]):
+        self.version = version
+        self.days = days
+        self.values = values
+        self.present = present
+        self.nbytes = SERIES_OVERHEAD_BYTES + days.nbytes + sum(
+            values[name].nbytes + present[name].nbytes for name in METRIC_DTYPES
+        )
+
+    @classmethod
+    def from_rows(cls, version: int, rows: Iterable[tuple]) -> "UserSeries":
+        """Construye la serie a partir de tuplas (log_date, métrica1, métrica2, ...) ordenadas por fecha."""
+        rows = list(rows)
+        days = np.fromiter((row[0].toordinal() for row in rows), dtype="int32", count=len(rows))
+        values, present = {}, {}
+        for index, (name, dtype) in enumerate(METRIC_DTYPES.items(), start=1):
+            raw = [row[index] for row in rows]
+            present[name] = np.fromiter((value is not None for value in raw), dtype=bool, count=len(raw))
+            values[name] = np.fromiter((0 if value is None else value for value in raw), dtype=dtype, count=len(raw))
+        return cls(version, days, values, present)
+
+    def with_log(self, version: int, log: dict) -> "UserSeries":
+        """Nueva serie con el log insertado o sustituido (`log` trae la fecha y todas las métricas)."""
+        day = log["log_date"].toordinal()
+        position = int(np.searchsorted(self.days, day))
+        exists = position < len(self.days) and self.days[position] == day
+        days = self.days if exists else np.insert(self.days, position, day)
+        values, present = {}, {}
+        for name, dtype in METRIC_DTYPES.items():
+            value = log.get(name)
+            if exists:
+                values[name], present[name] = self.values[name].copy(), self.present[name].copy()
+                values[name][position] = 0 if value is None else value
+                present[name][position] = value is not None
+            else:
+                values[name] = np.insert(self.values[name], position, 0 if value is None else value)
+                present[name] = np.insert(self.present[name], position, value is not None)
+        return UserSeries(version, days, values, present)
+
+    def stats(self, start: date, end: Optional[date]) -> Dict[str, dict]:
+        """count, sum, min y max por métrica en el rango (ambos extremos incluidos), con el mismo
+        formato que `compaction.archived_stats`. Se calcula sobre una porción contigua de los arrays."""
+        low = int(np.searchsorted(self.days, start.toordinal(), side="left"))
+        high = len(self.days) if end is None else int(np.searchsorted(self.days, end.toordinal(), side="right"))
+        result = {}
+        for name in METRIC_DTYPES:
+            selected = self.values[name][low:high][self.present[name][low:high]]
+            if not len(selected):
+                result[name] = {"count": 0, "sum": None, "min": None, "max": None}
+                continue
+            result[name] = {
+                "count": int(len(selected)),
+                "sum": selected.sum(dtype="float64").item() if selected.dtype.kind == "f" else int(selected.sum(dtype="int64")),
+                "min": selected.min().item(),
+                "max": selected.max().item(),
+            }
+        return result
+
+
+class TimeSeriesCache:
+    """Caché LRU de series por usuario con presupuesto de memoria global.
+
+    Cada serie guarda la `data_version` del usuario con la que se cargó: una lectura con otra versión
+    la recarga. Las escrituras de la API la parchean (`patch`) si la serie estaba en la versión
+    anterior a la escritura; en cualquier otro caso se descarta y se recarga en la siguiente lectura."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._series: "OrderedDict[str, UserSeries]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "patches": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, user_id: str, version: int, loader: Callable[[], Iterable[tuple]]) -> UserSeries:
+        """Serie del usuario en la versión indicada; si no está en caché (o es de otra versión) la carga
+        con `loader()`, que devuelve las filas (log_date, métricas...) ordenadas por fecha."""
+        with self._lock:
+            series = self._series.get(user_id)
+            if series is not None and series.version == version:
+                self._series.move_to_end(user_id)
+                self.counters["hits"] += 1
+                return series
+            self.counters["misses"] += 1
+        series = UserSeries.from_rows(version, loader())
+        with self._lock:
+            self._store(user_id, series)
+        return series
+
+    def patch(self, user_id: str, version: int, log: dict):
+        """Aplica un log recién confirmado. `version` es la data_version tras la escritura."""
+        with self._lock:
+            series = self._series.get(user_id)
+            if series is None:
+                return
+            if series.version != version - 1:
+                self._remove(user_id)
+                self.counters["invalidations"] += 1
+                return
+            self._store(user_id, series.with_log(version, log))
+            self.counters["patches"] += 1
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if user_id in self._series:
+                self._remove(user_id)
+                self.counters["invalidations"] += 1
+
+    def _store(self, user_id: str, series: UserSeries):
+        if user_id in self._series:
+            self._remove(user_id)
+        self._series[user_id] = series
+        self._bytes += series.nbytes
+        # Desalojo LRU de usuarios completos hasta volver al presupuesto
+        while self._bytes > self.budget_bytes and len(self._series) > 1:
+            oldest = next(iter(self._series))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def _remove(self, user_id: str):
+        self._bytes -= self._series.pop(user_id).nbytes
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"users": len(self._series), "bytes": self._bytes, "budget_bytes": self.budget_bytes, **self.counters}
+
+
+def create_cache() -> Optional[TimeSeriesCache]:
+    """Caché configurada con TRENDS_CACHE_MB, o None si está desactivada o numpy no está instalado."""
+    if TRENDS_CACHE_MB <= 0:
+        return None
+    if np is None:
+        logger.warning("numpy no está instalado: la caché de series está desactivada.")
+        return None
+    return TimeSeriesCache(int(TRENDS_CACHE_MB * 1024 * 1024))
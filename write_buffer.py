@@ -0,0 +1,210 @@
+import threading, time, logging
+from concurrent.futures import Future
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+
+from database import shard_index
+from compaction import is_compacted, compacted_month_detail
+from models import UserDB, DailyLogDB
+
+logger = logging.getLogger("main.write_buffer")
+
+
+class PendingWrite:
+    """Escritura de log encolada: operación ('insert' o 'update'), campos y futuro del cliente."""
+    __slots__ = ("op", "fields", "future")
+
+    def __init__(self, op: str, fields: dict):
+        self.op = op
+        self.fields = fields
+        self.future: Future = Future()
+
+
+class LogWriteBuffer:
+    """Buffer write-behind para los logs diarios.
+
+    Las escrituras ya validadas se encolan en memoria y un hilo en segundo plano las confirma en
+    commits agrupados cada `flush_interval_ms` milisegundos o cada `max_batch` escrituras. Las
+    operaciones sobre el mismo (user_id, log_date) se aplican en orden sobre una única lectura de
+    la fila, de modo que varias escrituras seguidas del mismo día cuestan una sola escritura en BD.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[str], object],
+        flush_interval_ms: int = 50,
+        max_batch: int = 500,
+        serialize: Optional[Callable[[DailyLogDB], dict]] = None,
+        before_commit: Optional[Callable] = None,
+        on_commit: Optional[Callable] = None,
+    ):
+        self._session_factory = session_factory  # session_factory(user_id): sesión en el shard del usuario
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_batch = max_batch
+        self._serialize = serialize
+        self._before_commit = before_commit      # before_commit(db, user_ids): dentro de la transacción
+        self._on_commit = on_commit              # on_commit(user_id, content): tras el commit, por escritura
+        self._pending: Dict[Tuple[str, date], List[PendingWrite]] = {}
+        self._size = 0
+        self._first_pending_at = 0.0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        # Métricas básicas
+        self.flushes = 0
+        self.rows_written = 0
+        self.writes_received = 0
+
+    # ------ Ciclo de vida ------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="log-write-buffer", daemon=True)
+        self._thread.start()
+        logger.info("Buffer write-behind de logs iniciado.")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Deja de aceptar escrituras y espera a que se vacíe la cola."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(f"Buffer write-behind detenido ({self.flushes} commits, {self.rows_written} filas).")
+
+    # ------ API pública ------
+    def submit(self, user_id: str, log_date: date, op: str, fields: dict) -> Future:
+        """Encola una escritura y devuelve un futuro que se resuelve con el log resultante tras el commit."""
+        write = PendingWrite(op, fields)
+        with self._cond:
+            if self._stopping or self._thread is None or not self._thread.is_alive():
+                raise HTTPException(status_code=503, detail="El servicio de escritura no está disponible.")
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.setdefault((user_id, log_date), []).append(write)
+            self._size += 1
+            self.writes_received += 1
+            self._cond.notify_all()
+        return write.future
+
+    def discard_user(self, user_id: str) -> int:
+        """Descarta las escrituras pendientes de un usuario (p.ej. al eliminar su cuenta)."""
+        discarded = []
+        with self._cond:
+            for key in [key for key in self._pending if key[0] == user_id]:
+                writes = self._pending.pop(key)
+                self._size -= len(writes)
+                discarded.extend(writes)
+        for write in discarded:
+            write.future.set_exception(HTTPException(status_code=404, detail="La cuenta del usuario ha sido eliminada."))
+        return len(discarded)
+
+    @staticmethod
+    def _reject(write: PendingWrite, user_id: str, log_date: date, status_code: int, detail: str):
+        """Rechaza una escritura del lote. Se registra porque, con durable=false, el cliente ya recibió un 202."""
+        logger.warning(f"Escritura diferida rechazada ({write.op}) del usuario {user_id} en la fecha {log_date}: {detail}")
+        write.future.set_exception(HTTPException(status_code=status_code, detail=detail))
+
+    # ------ Hilo de volcado ------
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                # Un commit agrupado por shard
+                by_shard: Dict[int, Dict[Tuple[str, date], List[PendingWrite]]] = {}
+                for key, writes in batch.items():
+                    by_shard.setdefault(shard_index(key[0]), {})[key] = writes
+                for shard_batch in by_shard.values():
+                    self._flush(shard_batch)
+            except Exception as e:
+                # Un error fuera de _flush no debe detener el hilo ni dejar a los clientes esperando
+                logger.error(f"Error en el hilo del buffer write-behind ({len(batch)} filas): {e}")
+                for writes in batch.values():
+                    for write in writes:
+                        if not write.future.done():
+                            write.future.set_exception(HTTPException(status_code=503, detail="No se ha podido guardar el log."))
+
+    def _take_batch(self) -> Optional[Dict[Tuple[str, date], List[PendingWrite]]]:
+        """Espera a completar un lote o a que venza el intervalo desde la primera escritura y lo saca de
+        la cola. Devuelve None al detenerse con la cola vacía."""
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if not self._pending and self._stopping:
+                return None
+            deadline = self._first_pending_at + self._flush_interval
+            while self._size < self._max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending, self._size = self._pending, {}, 0
+            return batch
+
+    def _flush(self, batch: Dict[Tuple[str, date], List[PendingWrite]]):
+        db = self._session_factory(next(iter(batch))[0])
+        results = []
+        applied = set()     # (user_id, log_date) con al menos una escritura aplicada
+        try:
+            # Las cuentas eliminadas mientras sus escrituras estaban en el lote no deben hacer fallar
+            # (por la clave foránea) el commit del resto de usuarios
+            user_ids = {user_id for user_id, _ in batch}
+            existing = {user_id for (user_id,) in db.query(UserDB.id).filter(UserDB.id.in_(user_ids))}
+            # Los endpoints ya rechazan los meses compactados; se comprueba otra vez por si la compactación
+            # ha avanzado mientras la escritura estaba en cola
+            for (user_id, log_date), writes in batch.items():
+                if user_id not in existing:
+                    for write in writes:
+                        self._reject(write, user_id, log_date, 404, "La cuenta del usuario ha sido eliminada.")
+                    continue
+                if is_compacted(db, user_id, log_date):
+                    for write in writes:
+                        self._reject(write, user_id, log_date, 400, compacted_month_detail(log_date))
+                    continue
+                row = db.get(DailyLogDB, (user_id, log_date))
+                for write in writes:
+                    if write.op == "insert":
+                        if row is not None:
+                            self._reject(write, user_id, log_date, 400, f"Ya existe un log para la fecha {log_date}. Usa PUT/PATCH para actualizarlo.")
+                            continue
+                        row = DailyLogDB(user_id=user_id, log_date=log_date, **write.fields)
+                        db.add(row)
+                    else:
+                        if row is None:
+                            self._reject(write, user_id, log_date, 400, f"No existe un log que modificar para la fecha {log_date}.")
+                            continue
+                        for key, value in write.fields.items():
+                            setattr(row, key, value)
+                    applied.add((user_id, log_date))
+                    # Cada cliente recibe el estado del log justo después de su operación
+                    results.append((write, user_id, self._serialize(row) if self._serialize else None))
+            if results:
+                db.flush()
+                if self._before_commit is not None:
+                    self._before_commit(db, {user_id for user_id, _ in applied})
+                db.commit()
+            self.flushes += 1
+            self.rows_written += len(applied)
+            logger.info(f"Commit agrupado: {len(results)} escrituras en {len(applied)} filas.")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error en el commit agrupado de logs ({len(batch)} filas): {e}")
+            for writes in batch.values():
+                for write in writes:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+            return
+        finally:
+            db.close()
+        for write, user_id, content in results:
+            write.future.set_result(content)
+            if self._on_commit is not None:
+                try:
+                    self._on_commit(user_id, content)
+                except Exception as e:
+                    logger.error(f"Error en el callback on_commit del usuario {user_id}: {e}")